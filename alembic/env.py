@@ -6,7 +6,7 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from src.database.database import get_database_url
-from src.database.models import Base
+from src.database.models import Base, IdType
 
 DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
@@ -31,6 +31,14 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 
+def render_item(type_, obj, autogen_context):
+    # render ids as their storage type so generated revisions don't import application code
+    if type_ == "type" and isinstance(obj, IdType):
+        autogen_context.imports.add("import sqlalchemy as sa")
+        return f"sa.{obj.storage_type()!r}"
+    return False
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -55,6 +63,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_item=render_item,
     )
 
     with context.begin_transaction():
@@ -83,7 +92,8 @@ def run_migrations_online():
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
-            process_revision_directives=process_revision_directives
+            process_revision_directives=process_revision_directives,
+            render_item=render_item,
         )
 
         with context.begin_transaction():
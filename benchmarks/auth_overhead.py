@@ -0,0 +1,45 @@
+"""
+Per-request access token verification overhead, with and without the verified-token cache.
+
+Usage (from the repository root):
+    python -m benchmarks.auth_overhead [--iterations 20000]
+"""
+import argparse
+import timeit
+
+from jose import jwt
+
+from src.utils.credentials import ALGORITHM, SECRET_KEY, create_access_token, decode_token, token_cache
+
+
+def report(label: str, seconds: float, iterations: int):
+    print(f"{label:<32} {seconds / iterations * 1e6:10.2f} us/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    token = create_access_token({"sub": "bench-user", "uid": "01HZY0000000000000000000", "name": "bench", "ver": 0})
+
+    before = timeit.timeit(lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), number=n)
+
+    def cold():
+        token_cache.clear()
+        decode_token(token)
+
+    miss = timeit.timeit(cold, number=n)
+
+    decode_token(token)
+    after = timeit.timeit(lambda: decode_token(token), number=n)
+
+    report("jwt.decode (before)", before, n)
+    report("decode_token, cache miss", miss, n)
+    report("decode_token, cache hit (after)", after, n)
+    print(f"{'speedup on hot token':<32} {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
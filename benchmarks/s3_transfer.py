@@ -0,0 +1,169 @@
+"""
+S3 upload throughput and latency across file sizes, against the local MinIO container
+(docker compose up minio). Tune the S3_* client and transfer settings by re-running with
+different environment variables, e.g. S3_TRANSFER_MAX_CONCURRENCY=16 S3_MULTIPART_PART_SIZE=16777216.
+
+Methods:
+    transfer  boto3 managed transfer with transfer_config (upload_local_to_s3)
+    stream    S3MultipartWriter fed in 64 KiB chunks (streaming request uploads)
+    put       a single PutObject
+
+Usage (from the repository root):
+    python -m benchmarks.s3_transfer [--sizes 256KiB,8MiB,64MiB] [--iterations 10] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import io
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# defaults for the docker-compose MinIO, reached from the host
+os.environ.setdefault("S3_PROVIDER", "minio")
+os.environ.setdefault("S3_ENDPOINT_URL", "http://localhost:9000")
+os.environ.setdefault("MINIO_ROOT_USER", "admin")
+os.environ.setdefault("MINIO_ROOT_PASSWORD", "admin1234")
+os.environ.setdefault("AWS_S3_BUCKET", "template-bucket")
+
+from src.utils import s3 as s3_utils  # noqa: E402
+
+BUCKET = os.environ["AWS_S3_BUCKET"]
+UNITS = {"kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "b": 1}
+CHUNK = 64 * 1024
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def format_size(size: int) -> str:
+    for unit in ("GiB", "MiB", "KiB"):
+        factor = UNITS[unit.lower()]
+        if size >= factor:
+            return f"{size / factor:g}{unit}"
+    return f"{size}B"
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def upload_transfer(key: str, data: bytes):
+    s3_utils.s3.upload_fileobj(
+        io.BytesIO(data), BUCKET, key,
+        ExtraArgs={"ContentType": "application/octet-stream"}, Config=s3_utils.transfer_config,
+    )
+
+
+def upload_put(key: str, data: bytes):
+    s3_utils.s3.put_object(
+        Bucket=BUCKET, Key=key, Body=data, ContentType="application/octet-stream"
+    )
+
+
+async def upload_stream(key: str, data: bytes):
+    async with s3_utils.S3MultipartWriter(key, "application/octet-stream") as writer:
+        with memoryview(data) as view:
+            for offset in range(0, len(data), CHUNK):
+                await writer.write(bytes(view[offset:offset + CHUNK]))
+        await writer.close()
+
+
+def run_sync(upload, keys: list[str], data: bytes, concurrency: int) -> list[float]:
+    def timed(key: str) -> float:
+        started_at = time.perf_counter()
+        upload(key, data)
+        return time.perf_counter() - started_at
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, keys))
+
+
+async def run_async(upload, keys: list[str], data: bytes, concurrency: int) -> list[float]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def timed(key: str) -> float:
+        async with slots:
+            started_at = time.perf_counter()
+            await upload(key, data)
+            return time.perf_counter() - started_at
+
+    return await asyncio.gather(*(timed(key) for key in keys))
+
+
+def cleanup(keys: list[str]):
+    for start in range(0, len(keys), 1000):
+        s3_utils.s3.delete_objects(
+            Bucket=BUCKET, Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True}
+        )
+
+
+def print_settings():
+    print(f"endpoint {os.environ['S3_ENDPOINT_URL']}, bucket {BUCKET}")
+    print(
+        f"pool connections {s3_utils.S3_MAX_POOL_CONNECTIONS}, retries {s3_utils.S3_RETRY_MODE}/"
+        f"{s3_utils.S3_MAX_ATTEMPTS}, tcp keepalive {s3_utils.S3_TCP_KEEPALIVE}, "
+        f"executor workers {s3_utils.s3_pool.max_workers}"
+    )
+    print(
+        f"multipart threshold {format_size(s3_utils.S3_MULTIPART_THRESHOLD)}, "
+        f"part size {format_size(s3_utils.S3_MULTIPART_PART_SIZE)}, "
+        f"transfer concurrency {s3_utils.S3_TRANSFER_MAX_CONCURRENCY}, "
+        f"stream parts in flight {s3_utils.S3_MULTIPART_MAX_IN_FLIGHT}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="256KiB,1MiB,8MiB,32MiB,128MiB")
+    parser.add_argument("--methods", default="transfer,stream,put")
+    parser.add_argument("--iterations", type=int, default=10, help="uploads per size and method")
+    parser.add_argument("--concurrency", type=int, default=1, help="uploads running at the same time")
+    args = parser.parse_args()
+
+    print_settings()
+    try:
+        s3_utils.s3.head_bucket(Bucket=BUCKET)
+    except (BotoCoreError, ClientError) as e:
+        raise SystemExit(f"Bucket {BUCKET} is not reachable: {e}")
+
+    prefix = f"benchmarks/s3_transfer/{uuid4()}/"
+    print(f"\n{'method':<10} {'size':>8} {'MiB/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for size in [parse_size(size) for size in args.sizes.split(",")]:
+        data = os.urandom(size)
+        for method in args.methods.split(","):
+            keys = [f"{prefix}{method}-{size}-{i}" for i in range(args.iterations)]
+            started_at = time.perf_counter()
+            if method == "stream":
+                latencies = await run_async(upload_stream, keys, data, args.concurrency)
+            elif method in ("transfer", "put"):
+                upload = upload_transfer if method == "transfer" else upload_put
+                latencies = await asyncio.to_thread(run_sync, upload, keys, data, args.concurrency)
+            else:
+                raise SystemExit(f"Unknown method: {method}")
+            elapsed = time.perf_counter() - started_at
+            try:
+                cleanup(keys)
+            except Exception as e:
+                print(f"cleanup of {prefix} failed: {e}")
+
+            throughput = size * len(keys) / elapsed / 1024 ** 2
+            print(
+                f"{method:<10} {format_size(size):>8} {throughput:9.1f} {percentile(latencies, 50) * 1e3:9.1f} "
+                f"{percentile(latencies, 99) * 1e3:9.1f} {max(latencies) * 1e3:9.1f}"
+            )
+
+    s3_utils.s3_pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
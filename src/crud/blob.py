@@ -0,0 +1,249 @@
+from datetime import datetime
+from typing import List, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from src.database import models
+from src.utils.handler import handle_error, handle_none_value
+from src.utils.pagination import decode_cursor, encode_cursor
+from src.utils.response_cache import invalidate_tags, user_tag
+
+user_blobs = models.user_blob_association
+
+
+@handle_error
+def create_user_blob(
+        db: Session,
+        user_id: str,
+        filename: str,
+        content_type: str,
+        url: str,
+        object_key: str | None = None,
+        digest: str | None = None,
+        size: int | None = None,
+        shared: bool = False
+) -> models.Blob:
+    """
+    Insert a blob and link it to the user in one transaction: two INSERTs, no reads.
+    Only the user id is needed, so callers don't have to load the User.
+    """
+    return create_user_blobs(db, user_id, [dict(
+        filename=filename, content_type=content_type, url=url,
+        object_key=object_key, digest=digest, size=size, shared=shared,
+    )])[0]
+
+
+@handle_error
+def create_user_blobs(
+        db: Session,
+        user_id: str,
+        entries: List[dict]
+) -> List[models.Blob]:
+    """
+    Insert several blobs for the user in one transaction, with one batched INSERT per table.
+    Entries hold Blob column values; an `id` is generated unless the entry has one.
+
+    An entry with `shared` reuses the object of an existing blob with the same content
+    (see find_stored_object). That blob is locked first, so a concurrent delete cannot
+    remove the object before the new reference is committed.
+    """
+    now = models.utcnow()
+    entries = [dict(entry) for entry in entries]
+    shared = [entry for entry in entries if entry.pop("shared", False)]
+    if shared and not _lock_shared_objects(db, shared):
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="The stored file was deleted meanwhile, upload it again")
+    blobs = [models.Blob(created_at=now, updated_at=now, **({"id": models.new_id()} | entry)) for entry in entries]
+    db.add_all(blobs)
+    db.flush()
+    db.execute(insert(user_blobs), [{"user_id": user_id, "blob_id": blob.id, "created_at": now} for blob in blobs])
+    db.commit()
+    invalidate_tags(user_tag(user_id))
+
+    return blobs
+
+
+@handle_error
+def find_stored_object(db: Session, digest: str, size: int) -> str | None:
+    """
+    Key of an object already holding this content, one lookup on ix_blobs_digest_size.
+    """
+    # a lagging replica may still list an object whose last blob was deleted
+    db.use_primary()
+    return db.execute(
+        select(models.Blob.object_key)
+        .where(models.Blob.digest == digest, models.Blob.size == size, models.Blob.object_key.is_not(None),
+               _is_ready())
+        .limit(1)
+    ).scalar()
+
+
+def _is_ready():
+    # pending objects may never reach S3, so nothing may share them yet
+    return or_(models.Blob.status.is_(None), models.Blob.status == "ready")
+
+
+@handle_error
+def get_blob(db: Session, blob_id: str) -> models.Blob | None:
+    return db.get(models.Blob, blob_id)
+
+
+@handle_error
+def find_object_analysis(db: Session, digest: str, size: int, object_key: str) -> dict | None:
+    """
+    Processing results of another blob sharing the object, so a deduplicated upload is not
+    downloaded and analyzed again. One lookup on ix_blobs_digest_size.
+    """
+    row = db.execute(
+        select(models.Blob.size, models.Blob.detected_type, models.Blob.file_metadata)
+        .where(models.Blob.digest == digest, models.Blob.size == size, models.Blob.object_key == object_key,
+               models.Blob.processed_at.is_not(None))
+        .limit(1)
+    ).first()
+    return dict(row._mapping) if row is not None else None
+
+
+@handle_error
+def save_blob_analysis(db: Session, blob_id: str, analysis: dict):
+    """
+    Write processing results back to the blob. The size is filled in where the upload path
+    didn't know it. The checksum stays in file_metadata rather than digest: a presigned
+    object may still be overwritten by its client, and digests feed deduplication.
+    """
+    db.execute(
+        update(models.Blob)
+        .where(models.Blob.id == blob_id)
+        .values(
+            size=func.coalesce(models.Blob.size, analysis["size"]),
+            detected_type=analysis["detected_type"],
+            file_metadata=analysis["file_metadata"],
+            processed_at=models.utcnow(),
+        )
+    )
+    user_ids = db.execute(select(user_blobs.c.user_id).where(user_blobs.c.blob_id == blob_id)).scalars().all()
+    db.commit()
+    invalidate_tags(*[user_tag(user_id) for user_id in user_ids])
+
+
+@handle_error
+def finish_pending_blob(db: Session, blob_id: str, blob_status: str) -> bool:
+    """
+    Flip a pending blob to ready or failed once its spooled upload finished. False if the
+    blob was deleted meanwhile; the row lock orders this against delete_user_blob.
+    """
+    # a lagging replica may not have the row yet, and a missing row deletes the object
+    db.use_primary()
+    blob = db.execute(select(models.Blob).where(models.Blob.id == blob_id).with_for_update()).scalar()
+    if blob is None:
+        db.rollback()
+        return False
+    if blob.status == "pending":
+        blob.status = blob_status
+    user_ids = db.execute(select(user_blobs.c.user_id).where(user_blobs.c.blob_id == blob_id)).scalars().all()
+    db.commit()
+    invalidate_tags(*[user_tag(user_id) for user_id in user_ids])
+    return True
+
+
+def _lock_shared_objects(db: Session, entries: List[dict]) -> bool:
+    # one SELECT ... FOR UPDATE for every object the entries share; False if one of them lost its last blob
+    objects = {(entry["digest"], entry["size"], entry["object_key"]) for entry in entries}
+    rows = db.execute(
+        select(models.Blob.digest, models.Blob.size, models.Blob.object_key)
+        .where(tuple_(models.Blob.digest, models.Blob.size, models.Blob.object_key).in_(objects))
+        .with_for_update()
+    ).all()
+    return objects <= {tuple(row) for row in rows}
+
+
+def _lock_references(db: Session, digest: str, size: int, object_key: str, exclude_id: str | None = None) -> int:
+    # SELECT ... FOR UPDATE on the blobs sharing an object; creates and deletes of them serialize here
+    query = select(models.Blob.id).where(
+        models.Blob.digest == digest, models.Blob.size == size, models.Blob.object_key == object_key
+    )
+    if exclude_id is not None:
+        query = query.where(models.Blob.id != exclude_id)
+    return len(db.execute(query.with_for_update()).all())
+
+
+def _user_blob_query(user_id: str, blob_id: str):
+    # ownership is the association row, one primary key lookup
+    return (
+        select(models.Blob)
+        .join(user_blobs, user_blobs.c.blob_id == models.Blob.id)
+        .where(user_blobs.c.user_id == user_id, models.Blob.id == blob_id)
+    )
+
+
+@handle_none_value("Blob")
+@handle_error
+def get_user_blob(db: Session, user_id: str, blob_id: str) -> models.Blob:
+    return db.execute(_user_blob_query(user_id, blob_id)).scalar()
+
+
+@handle_error
+def delete_user_blob(db: Session, user_id: str, blob_id: str) -> str | None:
+    """
+    Delete one of the user's blobs. Returns the key of its object once no other blob
+    references it any more; the caller removes it from S3 after the commit.
+    """
+    blob = db.execute(_user_blob_query(user_id, blob_id).with_for_update()).scalar()
+    if blob is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blob Not found")
+
+    orphaned_key = blob.object_key
+    if blob.digest is not None and blob.object_key is not None:
+        if _lock_references(db, blob.digest, blob.size, blob.object_key, exclude_id=blob.id):
+            orphaned_key = None
+
+    db.execute(delete(user_blobs).where(user_blobs.c.blob_id == blob.id))
+    db.execute(delete(models.Blob).where(models.Blob.id == blob.id))
+    db.commit()
+    invalidate_tags(user_tag(user_id))
+
+    return orphaned_key
+
+
+@handle_error
+def get_user_blobs_page(
+        db: Session,
+        user_id: str,
+        limit: int,
+        cursor: str | None = None
+) -> Tuple[List[models.Blob], str | None]:
+    """
+    One page of a user's blobs, newest first, read through the association table.
+
+    Keyset pagination on (created_at, blob_id) walks ix_user_chatrooms_user_created_blob,
+    so a page costs the same no matter how many blobs the user owns.
+    """
+    query = (
+        db.query(models.Blob, user_blobs.c.created_at)
+        .join(user_blobs, user_blobs.c.blob_id == models.Blob.id)
+        .filter(user_blobs.c.user_id == user_id)
+    )
+    if cursor is not None:
+        created_at, blob_id = decode_cursor(cursor, 2)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.filter(or_(
+            user_blobs.c.created_at < created_at,
+            and_(user_blobs.c.created_at == created_at, user_blobs.c.blob_id < blob_id),
+        ))
+    rows = (
+        query.order_by(user_blobs.c.created_at.desc(), user_blobs.c.blob_id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_blob, last_created_at = rows[-1]
+        next_cursor = encode_cursor(last_created_at.isoformat(), last_blob.id)
+    return [blob for blob, _ in rows], next_cursor
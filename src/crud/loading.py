@@ -0,0 +1,32 @@
+import os
+
+from sqlalchemy.orm import contains_eager, joinedload, raiseload
+
+from src.database import models
+from src.schemas import CustomStringEnum
+
+# Make every relationship that a load profile does not cover raise instead of lazy
+# loading, so tests catch hidden round-trips
+DB_STRICT_LOADING = os.getenv("DB_STRICT_LOADING", "false").lower() == "true"
+
+
+class UserLoad(CustomStringEnum):
+    BARE = "bare"            # user columns only, every relationship raises
+    ACCOUNT = "account"      # user and accounts in the same round-trip
+
+
+def user_load_options(profile: UserLoad, account_joined: bool = False) -> list:
+    """
+    Loader options for a User query. User.blobs is write-only; page through it with src.crud.blob.
+
+    Pass account_joined=True when the query already joins UserAccount (e.g. to filter by
+    username) so the accounts are populated from that join instead of a second one.
+    """
+    if profile == UserLoad.BARE:
+        return [raiseload("*")]
+
+    account = contains_eager(models.User.account) if account_joined else joinedload(models.User.account)
+    options = [account]
+    if DB_STRICT_LOADING:
+        options.append(raiseload("*"))
+    return options
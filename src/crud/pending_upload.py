@@ -0,0 +1,51 @@
+import json
+import os
+
+from fastapi import HTTPException, status
+
+from src.database import models
+from src.database.redis import get_async_redis
+
+# How long a presigned URL stays valid, and how much longer its upload may still be completed
+PRESIGNED_UPLOAD_EXPIRES = int(os.getenv("PRESIGNED_UPLOAD_EXPIRES", "900"))
+PRESIGNED_UPLOAD_COMPLETE_GRACE = int(os.getenv("PRESIGNED_UPLOAD_COMPLETE_GRACE", "3600"))
+
+REDIS_KEY_PREFIX = "upload:pending:"
+
+
+async def register_upload(user_id: str, s3_path: str, filename: str, content_type: str, max_size: int,
+                          size: int | None = None) -> str:
+    """
+    Remember a presigned upload until it is completed. Returns its upload id.
+    """
+    upload_id = models.new_id()
+    pending = {
+        "user_id": user_id,
+        "key": s3_path,
+        "filename": filename,
+        "content_type": content_type,
+        "max_size": max_size,
+        "size": size,
+    }
+    await get_async_redis().set(
+        REDIS_KEY_PREFIX + upload_id,
+        json.dumps(pending),
+        ex=PRESIGNED_UPLOAD_EXPIRES + PRESIGNED_UPLOAD_COMPLETE_GRACE,
+    )
+    return upload_id
+
+
+async def get_upload(upload_id: str, user_id: str) -> dict:
+    raw = await get_async_redis().get(REDIS_KEY_PREFIX + upload_id)
+    pending = json.loads(raw) if raw is not None else None
+    if pending is None or pending["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found or expired")
+    return pending
+
+
+async def claim_upload(upload_id: str):
+    """
+    Consume a pending upload; only one completion request can register its blob.
+    """
+    if await get_async_redis().getdel(REDIS_KEY_PREFIX + upload_id) is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload already completed")
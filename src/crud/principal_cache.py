@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from src.database import models
+from src.database.redis import get_async_redis, get_redis
+from src.utils.cache import TTLCache, write_cache_metrics
+from src.utils.metrics import PrometheusWriter, register_collector
+from src.utils.single_flight import SingleFlight, acquire_lock, release_lock, should_refresh_early, wait_for
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# Kept short: other workers only learn about invalidations through the Redis tier
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "10"))
+PRINCIPAL_CACHE_REDIS = os.getenv("PRINCIPAL_CACHE_REDIS", "true").lower() == "true"
+PRINCIPAL_CACHE_REDIS_TTL = int(os.getenv("PRINCIPAL_CACHE_REDIS_TTL", "300"))
+
+REDIS_KEY_PREFIX = "principal:"
+LOCK_KEY_PREFIX = "principal:lock:"
+
+USER_FIELDS = ("id", "name", "created_at", "updated_at")
+ACCOUNT_FIELDS = ("id", "username", "user_id", "created_at", "updated_at")
+DATETIME_FIELDS = ("created_at", "updated_at")
+
+local_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+redis_counters = {"hits": 0, "misses": 0, "errors": 0, "early_refreshes": 0, "lock_waits": 0}
+invalidations = {"count": 0}
+flights = SingleFlight("principal-cache")
+
+
+def _dump_row(instance, fields) -> dict:
+    row = {}
+    for field in fields:
+        value = getattr(instance, field)
+        row[field] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def _load_row(row: dict) -> dict:
+    return {
+        field: datetime.fromisoformat(value) if field in DATETIME_FIELDS and value else value
+        for field, value in row.items()
+    }
+
+
+def snapshot_user(user: models.User) -> dict:
+    """
+    Plain, session-independent copy of a user and its accounts. Password hashes are left out.
+    """
+    return {
+        "user": _dump_row(user, USER_FIELDS),
+        "accounts": [_dump_row(account, ACCOUNT_FIELDS) for account in user.account],
+    }
+
+
+def restore_user(db: Session, snapshot: dict) -> models.User:
+    """
+    Attach a snapshot to the session as a persistent user without emitting any SQL.
+    Columns that are not part of the snapshot are expired and load lazily on access.
+    """
+    key = identity_key(models.User, snapshot["user"]["id"])
+    existing = db.identity_map.get(key)
+    if existing is not None:
+        return existing
+
+    user = models.User(**_load_row(snapshot["user"]))
+    accounts = [models.UserAccount(**_load_row(row)) for row in snapshot["accounts"]]
+
+    make_transient_to_detached(user)
+    for account in accounts:
+        make_transient_to_detached(account)
+        set_committed_value(account, "user", [user])
+    set_committed_value(user, "account", accounts)
+
+    db.add(user)
+    return user
+
+
+async def _read_redis(username: str) -> dict | None:
+    try:
+        raw = await get_async_redis().get(REDIS_KEY_PREFIX + username)
+    except RedisError as e:
+        redis_counters["errors"] += 1
+        logger.warning(f"Principal cache read failed: {e}")
+        return None
+    if raw is None:
+        redis_counters["misses"] += 1
+        return None
+    snapshot = json.loads(raw)
+    if should_refresh_early(snapshot.get("delta", 0.0), snapshot.get("expires_at", float("inf"))):
+        # this caller reloads the user before the entry expires under every worker at once
+        redis_counters["early_refreshes"] += 1
+        return None
+    redis_counters["hits"] += 1
+    return snapshot
+
+
+async def _poll_redis(username: str) -> dict | None:
+    # waiting for another worker's load: any entry will do, early refresh is its business
+    try:
+        raw = await get_async_redis().get(REDIS_KEY_PREFIX + username)
+    except RedisError:
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+async def _write_redis(username: str, snapshot: dict, delta: float):
+    entry = {**snapshot, "delta": delta, "expires_at": time.time() + PRINCIPAL_CACHE_REDIS_TTL}
+    try:
+        await get_async_redis().set(REDIS_KEY_PREFIX + username, json.dumps(entry), ex=PRINCIPAL_CACHE_REDIS_TTL)
+    except RedisError as e:
+        redis_counters["errors"] += 1
+        logger.warning(f"Principal cache write failed: {e}")
+
+
+async def get_cached_user(db: Session, username: str) -> models.User | None:
+    if not PRINCIPAL_CACHE_ENABLED:
+        return None
+
+    snapshot = local_cache.get(username)
+    if snapshot is None and PRINCIPAL_CACHE_REDIS:
+        snapshot = await _read_redis(username)
+        if snapshot is not None:
+            local_cache.set(username, snapshot)
+    if snapshot is None:
+        return None
+
+    return restore_user(db, snapshot)
+
+
+async def cache_snapshot(username: str, snapshot: dict, delta: float = 0.0):
+    """
+    delta is how long loading the user took; it drives early refresh of the Redis entry.
+    """
+    if not PRINCIPAL_CACHE_ENABLED:
+        return
+
+    local_cache.set(username, snapshot)
+    if PRINCIPAL_CACHE_REDIS:
+        await _write_redis(username, snapshot, delta)
+
+
+async def load_snapshot(username: str, loader: Callable[[], Awaitable[models.User]]) -> dict:
+    """
+    Load a user that is not cached, coalescing concurrent misses: within a worker they
+    await one loader, across workers only the holder of a short Redis lock queries the
+    database while the others wait for its snapshot to appear in Redis.
+    """
+    return await flights.do(username, lambda: _load_snapshot(username, loader))
+
+
+async def _load_snapshot(username: str, loader: Callable[[], Awaitable[models.User]]) -> dict:
+    redis = get_async_redis()
+    token = None
+    if PRINCIPAL_CACHE_ENABLED and PRINCIPAL_CACHE_REDIS:
+        try:
+            token = await acquire_lock(redis, LOCK_KEY_PREFIX + username)
+            if token is None:
+                redis_counters["lock_waits"] += 1
+                snapshot = await wait_for(lambda: _poll_redis(username))
+                if snapshot is not None:
+                    local_cache.set(username, snapshot)
+                    return snapshot
+        except RedisError as e:
+            logger.warning(f"Principal cache lock failed: {e}")
+
+    try:
+        started_at = time.perf_counter()
+        snapshot = snapshot_user(await loader())
+        await cache_snapshot(username, snapshot, time.perf_counter() - started_at)
+        return snapshot
+    finally:
+        if token is not None:
+            try:
+                await release_lock(redis, LOCK_KEY_PREFIX + username, token)
+            except RedisError:
+                pass  # expires on its own
+
+
+def invalidate(*usernames: str):
+    """
+    Evict users from both tiers. Called from commit hooks, so on an event loop the Redis
+    delete is sent by a task instead of blocking the loop; elsewhere (threads, scripts)
+    it is sent right away.
+    """
+    for username in usernames:
+        local_cache.pop(username)
+    if PRINCIPAL_CACHE_REDIS and usernames:
+        keys = [REDIS_KEY_PREFIX + username for username in usernames]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                get_redis().delete(*keys)
+            except RedisError as e:
+                _invalidation_failed(e)
+        else:
+            task = loop.create_task(_delete_redis(keys))
+            _evictions.add(task)
+            task.add_done_callback(_evictions.discard)
+    invalidations["count"] += len(usernames)
+
+
+# strong references to in-flight Redis deletes, so they are not garbage collected
+_evictions: set[asyncio.Task] = set()
+
+
+async def _delete_redis(keys: list[str]):
+    try:
+        await get_async_redis().delete(*keys)
+    except RedisError as e:
+        _invalidation_failed(e)
+
+
+def _invalidation_failed(e: RedisError):
+    redis_counters["errors"] += 1
+    logger.warning(f"Principal cache invalidation failed: {e}")
+
+
+def stats() -> dict:
+    return {
+        "enabled": PRINCIPAL_CACHE_ENABLED,
+        "local": local_cache.stats(),
+        "redis": {"enabled": PRINCIPAL_CACHE_REDIS, "ttl": PRINCIPAL_CACHE_REDIS_TTL, **redis_counters},
+        "invalidations": invalidations["count"],
+        "single_flight": flights.stats(),
+    }
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    write_cache_metrics(writer, "principal", local_cache)
+    for key, value in redis_counters.items():
+        writer.counter(f"principal_cache_redis_{key}_total", value, f"Principal cache Redis {key.replace('_', ' ')}")
+    writer.counter("principal_cache_invalidations_total", invalidations["count"], "Evicted principal cache entries")
+    writer.counter("principal_cache_coalesced_total", flights.followers,
+                   "Lookups that awaited another request's in-flight load")
+
+
+# Invalidation: rows changed during a flush are collected on the session and
+# evicted once the transaction commits, so readers never re-cache the old row
+# from a transaction that is still in flight.
+
+PENDING_KEY = "principal_cache_pending"
+
+
+def _pending(target) -> set | None:
+    session = Session.object_session(target)
+    if session is None:
+        return None
+    return session.info.setdefault(PENDING_KEY, set())
+
+
+def _columns_changed(mapper, target) -> bool:
+    # collection-only changes (e.g. appending to User.blobs) also fire after_update
+    state = inspect(target)
+    return any(state.attrs[attr.key].history.has_changes() for attr in mapper.column_attrs)
+
+
+def _evict_user(mapper, connection, target):
+    pending = _pending(target)
+    if pending is None:
+        return
+    accounts = inspect(target).attrs.account.loaded_value
+    if isinstance(accounts, list):
+        pending.update(account.username for account in accounts)
+    else:
+        pending.update(connection.scalars(
+            select(models.UserAccount.username).where(models.UserAccount.user_id == target.id)
+        ))
+
+
+def _evict_account(mapper, connection, target):
+    pending = _pending(target)
+    if pending is None:
+        return
+    history = inspect(target).attrs.username.history
+    pending.update(username for username in (*history.deleted, target.username) if username)
+
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target):
+    if _columns_changed(mapper, target):
+        _evict_user(mapper, connection, target)
+
+
+@event.listens_for(models.UserAccount, "after_update")
+def _account_updated(mapper, connection, target):
+    if _columns_changed(mapper, target):
+        _evict_account(mapper, connection, target)
+
+
+event.listen(models.User, "after_delete", _evict_user)
+event.listen(models.UserAccount, "after_delete", _evict_account)
+
+
+@event.listens_for(Session, "after_commit")
+def _flush_invalidations(session: Session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        invalidate(*pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session: Session):
+    session.info.pop(PENDING_KEY, None)
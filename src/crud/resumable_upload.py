@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.database import models
+from src.database.redis import get_async_redis
+from src.utils.single_flight import acquire_lock, extend_lock, release_lock
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# Idle sessions expire after this many seconds; every accepted chunk extends it
+RESUMABLE_UPLOAD_EXPIRES = int(os.getenv("RESUMABLE_UPLOAD_EXPIRES", str(24 * 3600)))
+# A request holds the session lock for this long; it is extended every third of it while the request runs
+RESUMABLE_UPLOAD_LOCK_TTL = float(os.getenv("RESUMABLE_UPLOAD_LOCK_TTL", "60"))
+
+REDIS_KEY_PREFIX = "upload:resumable:"
+LOCK_PREFIX = "upload:resumable:lock:"
+
+
+async def create_session(user_id: str, s3_path: str, s3_upload_id: str, filename: str, content_type: str,
+                         size: int, part_size: int) -> str:
+    """
+    Start tracking a resumable upload. Returns its upload id.
+    """
+    upload_id = models.new_id()
+    await save_session(upload_id, {
+        "user_id": user_id,
+        "key": s3_path,
+        "s3_upload_id": s3_upload_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "part_size": part_size,
+        "offset": 0,
+        "parts": [],
+    })
+    return upload_id
+
+
+async def get_session(upload_id: str, user_id: str) -> dict:
+    raw = await get_async_redis().get(REDIS_KEY_PREFIX + upload_id)
+    session = json.loads(raw) if raw is not None else None
+    if session is None or session["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found or expired")
+    return session
+
+
+async def save_session(upload_id: str, session: dict):
+    await get_async_redis().set(REDIS_KEY_PREFIX + upload_id, json.dumps(session), ex=RESUMABLE_UPLOAD_EXPIRES)
+
+
+async def delete_session(upload_id: str):
+    await get_async_redis().delete(REDIS_KEY_PREFIX + upload_id)
+
+
+@asynccontextmanager
+async def locked_session(upload_id: str):
+    """
+    Only one request may append to or finish an upload at a time; others get 423.
+
+    The lock is extended in the background for as long as the request runs, however slowly
+    its body arrives. Yields a coroutine function to await before every session write: it
+    raises 409 if the lock was lost meanwhile, so a request that lost it never overwrites
+    the state of the one that took over.
+    """
+    redis = get_async_redis()
+    key = LOCK_PREFIX + upload_id
+    token = await acquire_lock(redis, key, RESUMABLE_UPLOAD_LOCK_TTL)
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_423_LOCKED, detail="Upload is in use by another request",
+                            headers={"Retry-After": "1"})
+
+    lost = asyncio.Event()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(RESUMABLE_UPLOAD_LOCK_TTL / 3)
+            try:
+                if not await extend_lock(redis, key, token, RESUMABLE_UPLOAD_LOCK_TTL):
+                    lost.set()
+                    return
+            except RedisError as e:
+                logger.warning(f"Extending the lock of resumable upload {upload_id} failed: {e}")
+
+    async def ensure_locked():
+        if lost.is_set() or not await extend_lock(redis, key, token, RESUMABLE_UPLOAD_LOCK_TTL):
+            lost.set()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload was taken over by another request")
+
+    extending = asyncio.create_task(heartbeat())
+    try:
+        yield ensure_locked
+    finally:
+        extending.cancel()
+        await release_lock(redis, key, token)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.database import models
+from src.database.database import SessionLocal
+from src.database.redis import get_async_redis
+from src.utils.cache import TTLCache, write_cache_metrics
+from src.utils.metrics import PrometheusWriter, register_collector
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# How long a worker may keep honouring a token after it was revoked elsewhere
+TOKEN_VERSION_CACHE_TTL = float(os.getenv("TOKEN_VERSION_CACHE_TTL", "5"))
+TOKEN_VERSION_CACHE_SIZE = int(os.getenv("TOKEN_VERSION_CACHE_SIZE", "10000"))
+
+REDIS_KEY_PREFIX = "token-version:"
+
+# The users.token_version column is the source of truth; Redis holds a copy. Copies only
+# ever move forward, so a reader repopulating the key can't undo a concurrent revocation.
+_STORE_MAX_SCRIPT = """
+local current = tonumber(redis.call("get", KEYS[1]) or "-1")
+local version = tonumber(ARGV[1])
+if version > current then
+    redis.call("set", KEYS[1], version)
+    return version
+end
+return current
+"""
+
+local_cache = TTLCache(maxsize=TOKEN_VERSION_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
+
+
+def _read_version(user_id: str) -> int | None:
+    with SessionLocal() as db:
+        # a lagging replica could hand back a version from before a revocation
+        db.use_primary()
+        user = db.get(models.User, user_id)
+        return None if user is None else user.token_version
+
+
+def _bump_version(user_id: str, at_least: int) -> int | None:
+    with SessionLocal() as db:
+        user = db.get(models.User, user_id, with_for_update=True)
+        if user is None:
+            return None
+        user.token_version = max(user.token_version + 1, at_least)
+        db.commit()
+        return user.token_version
+
+
+async def _store(user_id: str, version: int) -> int:
+    return int(await get_async_redis().eval(_STORE_MAX_SCRIPT, 1, REDIS_KEY_PREFIX + user_id, version))
+
+
+async def get_token_version(user_id: str) -> int | None:
+    """
+    Current token version of a user, or None when it could not be checked (Redis is
+    unreachable or the user is gone). A missing Redis key, e.g. after a flush, is filled
+    from the database instead of being taken for version 0.
+    """
+    version = local_cache.get(user_id)
+    if version is not None:
+        return version
+    try:
+        redis = get_async_redis()
+        raw = await redis.get(REDIS_KEY_PREFIX + user_id)
+        if raw is not None:
+            version = int(raw)
+        else:
+            version = await asyncio.to_thread(_read_version, user_id)
+            if version is None:
+                return None
+            version = await _store(user_id, version)
+    except RedisError as e:
+        logger.warning(f"Token version lookup failed: {e}")
+        return None
+    local_cache.set(user_id, version)
+    return version
+
+
+async def revoke_tokens(user_id: str) -> int:
+    """
+    Invalidate every claims token issued to the user so far.
+    """
+    try:
+        # versions counted in Redis alone, before the column existed, must be passed too
+        current = int(await get_async_redis().get(REDIS_KEY_PREFIX + user_id) or -1)
+    except RedisError:
+        current = -1
+    version = await asyncio.to_thread(_bump_version, user_id, current + 1)
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    local_cache.pop(user_id)
+    try:
+        version = await _store(user_id, version)
+    except RedisError as e:
+        # the next lookup on a worker whose copy expired still sees the old version
+        logger.error(f"Publishing token version of {user_id} failed: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Tokens revoked in the database but not yet in Redis, try again")
+    return version
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    write_cache_metrics(writer, "token_version", local_cache)
@@ -1,17 +1,41 @@
 from typing import Type
 
 from sqlalchemy.orm import Session
-from ulid import ULID
 
+from src.crud.loading import UserLoad, user_load_options
 from src.database import models
 from src.utils.credentials import hash_password
 from src.utils.handler import handle_error, handle_none_value
+from src.utils.response_cache import invalidate_tags, user_tag
 
 
 @handle_none_value("User")
 @handle_error
-def get_user_by_id(db: Session, user_id: str) -> Type[models.User] | models.User | None:
-    user = db.query(models.User).filter_by(id=user_id).first()
+def get_user_by_id(
+        db: Session,
+        user_id: str,
+        load: UserLoad = UserLoad.ACCOUNT
+) -> Type[models.User] | models.User | None:
+    user = db.query(models.User).options(*user_load_options(load)).filter_by(id=user_id).first()
+    return user
+
+
+def build_user(name: str, username: str, password_hash: str, user_id: str | None = None) -> models.User:
+    """
+    User with its account attached, ready to be inserted by a single flush. Ids and
+    timestamps are generated client-side, so nothing has to be read back afterwards.
+    """
+    user = models.User(
+        id=user_id or models.new_id(),
+        name=name
+    )
+    user.account = [
+        models.UserAccount(
+            id=models.new_id(),
+            username=username,
+            password=password_hash,
+        )
+    ]
     return user
 
 
@@ -21,25 +45,11 @@ def create_user(
         name: str,
         username: str,
         password: str,
-        user_id: str = str(ULID())
+        user_id: str | None = None
 ) -> Type[models.User] | models.User | None:
-    user = models.User(
-        id=user_id,
-        name=name
-    )
+    user = build_user(name, username, hash_password(password), user_id)
     db.add(user)
     db.commit()
-    db.refresh(user)
-
-    account = models.UserAccount(
-        id=str(ULID()),
-        username=username,
-        password=hash_password(password),
-        user_id=user.id
-    )
-    db.add(account)
-    db.commit()
-    db.refresh(account)
-    db.refresh(user)
+    invalidate_tags(user_tag(user.id))
 
     return user
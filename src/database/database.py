@@ -2,8 +2,11 @@ import os
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from src.database.models import Base
+from src.database.routing import ReplicaSet, RoutingSession
+from src.database.telemetry import InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_engine
 
 DB_HOST = os.getenv("DB_HOST", "mysql")
 DB_USER = os.getenv("DB_USER", "admin")
@@ -12,11 +15,20 @@ DB_PORT = os.getenv("DB_PORT", "3306")
 DB_NAME = os.getenv("DB_NAME", "template_db")
 
 
-def get_database_url(user, password, host, port, db_name=None):
-    base_url = f"mysql+pymysql://{user}:{password}@{host}:{port}"
+def get_database_url(user, password, host, port, db_name=None, driver="pymysql"):
+    base_url = f"mysql+{driver}://{user}:{password}@{host}:{port}"
     return f"{base_url}/{db_name}?charset=utf8mb4" if db_name else base_url
 
 
+def get_async_database_url(user, password, host, port, db_name=None):
+    return get_database_url(user, password, host, port, db_name, driver="aiomysql")
+
+
+def get_replica_url(replica_host):
+    host, _, port = replica_host.partition(":")
+    return get_database_url(DB_USER, DB_PASS, host, port or DB_PORT, DB_NAME)
+
+
 def drop_database(url, db_name):
     try:
         with create_engine(url).connect() as connection:
@@ -54,6 +66,7 @@ def create_all_tables(_engine=None):
 # Construct URLs
 TRIAL_URL = get_database_url(DB_USER, DB_PASS, DB_HOST, DB_PORT)
 SQLALCHEMY_DATABASE_URL = get_database_url(DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME)
+ASYNC_SQLALCHEMY_DATABASE_URL = get_async_database_url(DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME)
 
 # Create the database if it doesn't exist
 create_database_if_not_exists(TRIAL_URL, DB_NAME)
@@ -66,9 +79,7 @@ POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "600"))  # recycle before RDS id
 POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true"
 CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
 
-# Create engine with connection pooling options better suited for AWS RDS Proxy
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
+ENGINE_OPTIONS = dict(
     pool_pre_ping=True,                # validate connections (essential behind proxies)
     pool_recycle=POOL_RECYCLE,
     pool_size=POOL_SIZE,
@@ -78,5 +89,35 @@ engine = create_engine(
     pool_reset_on_return="rollback",
     connect_args={"connect_timeout": CONNECT_TIMEOUT}
 )
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Read replicas: comma separated host[:port] list, each gets its own pool with the same settings
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))  # seconds behind source
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))
+
+# Create engine with connection pooling options better suited for AWS RDS Proxy
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **ENGINE_OPTIONS)
+instrument_engine(engine, "primary", recycle=POOL_RECYCLE)
+
+replica_engines = [
+    create_engine(get_replica_url(host), poolclass=InstrumentedQueuePool, **ENGINE_OPTIONS)
+    for host in DB_REPLICA_HOSTS
+]
+for replica_host, replica_engine in zip(DB_REPLICA_HOSTS, replica_engines):
+    instrument_engine(replica_engine, f"replica:{replica_host}", recycle=POOL_RECYCLE)
+replicas = ReplicaSet(replica_engines, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_CHECK_INTERVAL)
+
+# Create a configured "Session" class; reads go to a healthy replica until the session writes.
+# expire_on_commit=False: sessions are request scoped, and ids/timestamps are generated
+# client-side, so re-selecting every committed row would only add round-trips
+SessionLocal = sessionmaker(
+    class_=RoutingSession, replicas=replicas, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+# Async engine with its own pool (same settings), for routes that await their queries
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **ENGINE_OPTIONS
+)
+instrument_engine(async_engine, "primary-async", recycle=POOL_RECYCLE)
+# expire_on_commit=False: async sessions cannot lazily reload expired attributes
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
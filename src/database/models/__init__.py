@@ -1,4 +1,5 @@
-from .base import Base, lazy_relationship, user_blob_association
+from .base import Base, IdType, id_column, lazy_relationship, new_id, user_blob_association, utcnow
 from .sample import User, UserAccount, Blob
 
-__all__ = ["User", "UserAccount", "Blob", "user_blob_association", "lazy_relationship", "Base"]
\ No newline at end of file
+__all__ = ["User", "UserAccount", "Blob", "user_blob_association", "lazy_relationship", "Base", "IdType", "id_column",
+           "new_id", "utcnow"]
\ No newline at end of file
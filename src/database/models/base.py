@@ -1,15 +1,75 @@
-from sqlalchemy import Column, ForeignKey, String, Table
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import BINARY, Column, DateTime, ForeignKey, Index, String, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
+from ulid import ULID
 
 Base = declarative_base()
 
+# Store ids as 16 raw bytes instead of text. Only for fresh schemas: existing
+# textual (uuid4) ids cannot be converted to ULID bytes.
+DB_BINARY_IDS = os.getenv("DB_BINARY_IDS", "false").lower() == "true"
+
+
+def new_id() -> str:
+    """
+    Time-ordered id for every table. ULIDs generated in the same millisecond are
+    monotonic, so inserts append to the end of the InnoDB clustered index.
+    """
+    return str(ULID())
+
+
+class IdType(TypeDecorator):
+    """
+    ULID string on the Python side, stored as VARCHAR(36) or, with DB_BINARY_IDS, BINARY(16).
+    """
+
+    impl = String(36)
+    cache_ok = True
+
+    @staticmethod
+    def storage_type():
+        return BINARY(16) if DB_BINARY_IDS else String(36)
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(self.storage_type())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not DB_BINARY_IDS:
+            return value
+        return ULID.from_str(value).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or not DB_BINARY_IDS:
+            return value
+        return str(ULID.from_bytes(value))
+
+
+def utcnow() -> datetime:
+    """
+    Client-side timestamp default, so inserts never have to read created_at/updated_at back.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def id_column() -> Column:
+    # the primary key is already unique and indexed; no extra index
+    return Column(IdType, primary_key=True, default=new_id)
+
+
 def lazy_relationship(*args, **kwargs):
     return relationship(*args, uselist=True, **kwargs)
 
 user_blob_association = Table(
     "user_chatrooms",
     Base.metadata,
-    Column("user_id", String(36), ForeignKey("users.id"), primary_key=True),
-    Column("blob_id", String(36), ForeignKey("blobs.id"), primary_key=True),
-)
\ No newline at end of file
+    Column("user_id", IdType, ForeignKey("users.id"), primary_key=True),
+    Column("blob_id", IdType, ForeignKey("blobs.id"), primary_key=True),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+    # keyset pagination of a user's blobs: newest first, blob id breaks ties
+    Index("ix_user_chatrooms_user_created_blob", "user_id", "created_at", "blob_id"),
+)
@@ -1,43 +1,65 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
-from sqlalchemy.sql import func
+from sqlalchemy import BigInteger, Column, String, DateTime, ForeignKey, Index, Integer, JSON
 
-from src.database.models.base import Base, lazy_relationship, user_blob_association
+from src.database.models.base import Base, IdType, id_column, lazy_relationship, user_blob_association, utcnow
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String(36), primary_key=True, index=True, unique=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    id = id_column()
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
 
     name = Column(String(16, collation='utf8mb4_bin'), unique=True, index=True)
+    # bumped to revoke the user's claims tokens (see src.crud.token_version); Redis holds a copy
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     account = lazy_relationship("UserAccount", back_populates="user")
 
-    blobs = lazy_relationship("Blob", secondary=user_blob_association, backref="users")
+    # write-only: appending a blob is a single INSERT; read blobs through src.crud.blob
+    blobs = lazy_relationship("Blob", secondary=user_blob_association, backref="users", lazy="write_only")
 
 
 class UserAccount(Base):
     __tablename__ = "accounts"
 
-    id = Column(String(36), primary_key=True, index=True, unique=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    id = id_column()
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
 
     username = Column(String(16, collation='utf8mb4_bin'), unique=True, index=True)
     password = Column(String(256))
 
-    user_id = Column(String(36), ForeignKey("users.id"))
+    user_id = Column(IdType, ForeignKey("users.id"))
     user = lazy_relationship("User", back_populates="account")
 
 
 class Blob(Base):
     __tablename__ = "blobs"
 
-    id = Column(String(36), primary_key=True, index=True, unique=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    id = id_column()
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
 
     content_type = Column(String(16))
     filename = Column(String(512, collation='utf8mb4_bin'))
     url = Column(String(1024))
+
+    # the stored object; blobs with the same content share it (null for blobs uploaded before)
+    object_key = Column(String(512))
+    # hex SHA-256 of the content, null when the bytes never passed through the API (presigned uploads)
+    digest = Column(String(64))
+    size = Column(BigInteger)
+
+    # pending while an upload acknowledged early is still on its way to S3 (see src.utils.spool),
+    # then ready or failed; null for blobs created before, which are ready
+    status = Column(String(16), default="ready")
+
+    # written by the process_blob job (src.jobs.tasks); null until it ran
+    detected_type = Column(String(64))
+    file_metadata = Column(JSON)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        # dedup lookups and reference counting of a shared object
+        Index("ix_blobs_digest_size", "digest", "size"),
+    )
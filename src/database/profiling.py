@@ -0,0 +1,152 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# off: no checks, log: warn about offending routes, raise: fail the request (use in tests/CI)
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log").lower()
+QUERY_BUDGET_MAX_STATEMENTS = int(os.getenv("QUERY_BUDGET_MAX_STATEMENTS", "20"))
+# the same statement shape executed more often than this within one request is an N+1
+QUERY_BUDGET_MAX_REPEATS = int(os.getenv("QUERY_BUDGET_MAX_REPEATS", "5"))
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryProfile:
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.shapes: Counter[str] = Counter()
+        # extra repeats declared for statement shapes run inside allow_repeats()
+        self.allowed_repeats: Counter[str] = Counter()
+
+    def violations(self, max_statements: int, max_repeats: int) -> list[str]:
+        problems = []
+        # declared repeats don't count against the statement budget either, up to their allowance
+        max_statements += sum(min(self.shapes[shape], allowed) for shape, allowed in self.allowed_repeats.items())
+        if self.statements > max_statements:
+            problems.append(f"{self.statements} statements (budget {max_statements})")
+        for shape, count in self.shapes.most_common():
+            if count <= max_repeats:
+                break
+            if count > max_repeats + self.allowed_repeats[shape]:
+                problems.append(f"N+1 suspect, {count}x: {' '.join(shape.split())[:200]}")
+        return problems
+
+
+current_profile: ContextVar[QueryProfile | None] = ContextVar("current_profile", default=None)
+_allowed_repeats: ContextVar[int] = ContextVar("allowed_repeats", default=0)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None:
+        return
+    started = conn.info.get("query_started_at")
+    if started:
+        profile.db_seconds += time.perf_counter() - started.pop()
+    profile.statements += 1
+    profile.shapes[statement] += 1
+    allowed = _allowed_repeats.get()
+    if allowed > profile.allowed_repeats[statement]:
+        profile.allowed_repeats[statement] = allowed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # after_cursor_execute doesn't run for a failed statement; don't leave its start time
+    # behind on a pooled connection
+    started = context.connection.info.get("query_started_at") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+@contextmanager
+def count_queries():
+    """
+    Collect statements executed inside the block, e.g. to assert a route's query count in tests.
+    """
+    profile = QueryProfile()
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+
+@contextmanager
+def allow_repeats(count: int):
+    """
+    Statements run inside the block may repeat up to `count` more times per request, for
+    one bounded lookup per item that cannot be batched (e.g. per streamed file). Other
+    statement shapes of the request keep the normal budget.
+    """
+    token = _allowed_repeats.set(count)
+    try:
+        yield
+    finally:
+        _allowed_repeats.reset(token)
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts statements and DB time per request, reports them as response headers
+    and enforces QUERY_BUDGET_* according to QUERY_BUDGET_MODE.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            mode: str = QUERY_BUDGET_MODE,
+            max_statements: int = QUERY_BUDGET_MAX_STATEMENTS,
+            max_repeats: int = QUERY_BUDGET_MAX_REPEATS,
+    ):
+        self.app = app
+        self.mode = mode
+        self.max_statements = max_statements
+        self.max_repeats = max_repeats
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or self.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries() as profile:
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start":
+                    self.check(scope, profile)
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-DB-Statements", str(profile.statements))
+                    headers.append("Server-Timing", f"db;dur={profile.db_seconds * 1000:.2f}")
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+    def check(self, scope: Scope, profile: QueryProfile):
+        problems = profile.violations(self.max_statements, self.max_repeats)
+        if not problems:
+            return
+        message = f"Query budget exceeded on {scope['method']} {scope['path']}: " + "; ".join(problems)
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
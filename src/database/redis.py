@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+
+from redis import BlockingConnectionPool, StrictRedis as Redis
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool, StrictRedis as AsyncRedis
+from redis.exceptions import ConnectionError, RedisError
+from redis.utils import HIREDIS_AVAILABLE
+
+from src.utils.metrics import Histogram, PrometheusWriter, register_collector
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+# per worker process; each of the sync and async pools may open this many connections
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# how long a command may wait for a free connection before failing
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "1"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "0.5"))
+# idle connections are PINGed before reuse after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+
+class RedisPoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.max_in_use = 0
+        self.checkout_wait = Histogram()
+
+    def gauges(self) -> dict:
+        if self.pool is None:
+            return {}
+        (idle, _), (in_use, _) = self.pool.get_connection_count()
+        return {"idle": idle, "in_use": in_use, "max_connections": self.pool.max_connections}
+
+    def observe(self, started_at: float):
+        self.checkouts += 1
+        self.checkout_wait.observe(time.perf_counter() - started_at)
+        self.max_in_use = max(self.max_in_use, self.gauges().get("in_use", 0))
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            **self.gauges(),
+            "max_in_use": self.max_in_use,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "checkout_wait_seconds": self.checkout_wait.stats(),
+        }
+
+
+sync_metrics = RedisPoolMetrics("sync")
+async_metrics = RedisPoolMetrics("async")
+
+
+class InstrumentedBlockingConnectionPool(BlockingConnectionPool):
+    def get_connection(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except ConnectionError:
+            # pool exhausted for REDIS_POOL_TIMEOUT, or connecting a new connection failed
+            sync_metrics.checkout_failures += 1
+            raise
+        sync_metrics.observe(started_at)
+        return connection
+
+
+class InstrumentedAsyncBlockingConnectionPool(AsyncBlockingConnectionPool):
+    async def get_connection(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except ConnectionError:
+            async_metrics.checkout_failures += 1
+            raise
+        async_metrics.observe(started_at)
+        return connection
+
+
+def _pool_options() -> dict:
+    return dict(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=True,
+    )
+
+
+_pool: InstrumentedBlockingConnectionPool | None = None
+_async_pool: InstrumentedAsyncBlockingConnectionPool | None = None
+
+
+def get_redis() -> Redis:
+    """
+    Redis client backed by the per-process connection pool. Clients are cheap; the pool
+    owns the connections, so there is nothing to close after use.
+    """
+    global _pool
+    if _pool is None:
+        _pool = InstrumentedBlockingConnectionPool(**_pool_options())
+        sync_metrics.pool = _pool
+    return Redis(connection_pool=_pool)
+
+
+def get_async_redis() -> AsyncRedis:
+    """
+    asyncio Redis client backed by the per-process async pool. Use from async routes so
+    Redis round-trips don't block the event loop.
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = InstrumentedAsyncBlockingConnectionPool(**_pool_options())
+        async_metrics.pool = _async_pool
+    return AsyncRedis(connection_pool=_async_pool)
+
+
+async def init_redis():
+    """
+    Create both pools at startup and check that Redis is reachable. Redis backed
+    features degrade on errors, so an unreachable server is only logged.
+    """
+    get_redis()
+    try:
+        await get_async_redis().ping()
+    except RedisError as e:
+        logger.warning(f"Redis is not reachable at {REDIS_HOST}:{REDIS_PORT}: {e}")
+
+
+async def close_redis():
+    global _pool, _async_pool
+    if _async_pool is not None:
+        await _async_pool.aclose()
+        _async_pool = None
+        async_metrics.pool = None
+    if _pool is not None:
+        _pool.disconnect()
+        _pool = None
+        sync_metrics.pool = None
+
+
+def redis_stats() -> dict:
+    return {
+        "parser": "hiredis" if HIREDIS_AVAILABLE else "python",
+        "pools": [sync_metrics.stats(), async_metrics.stats()],
+    }
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    for metrics in (sync_metrics, async_metrics):
+        pool = metrics.name
+        for key, value in metrics.gauges().items():
+            writer.gauge(f"redis_pool_{key}", value, f"Redis connection pool {key.replace('_', ' ')}", pool=pool)
+        writer.gauge("redis_pool_max_in_use", metrics.max_in_use,
+                     "Highest number of simultaneously used Redis connections", pool=pool)
+        writer.counter("redis_pool_checkouts_total", metrics.checkouts, "Redis connection checkouts", pool=pool)
+        writer.counter("redis_pool_checkout_failures_total", metrics.checkout_failures,
+                       "Checkouts that timed out or could not connect", pool=pool)
+        writer.histogram("redis_pool_checkout_wait_seconds", metrics.checkout_wait,
+                         "Time spent waiting for a Redis connection", pool=pool)
@@ -0,0 +1,147 @@
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import Engine, Select, text
+from sqlalchemy.orm import Session
+
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+
+class Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        # unknown until the first check: reads stay on the primary meanwhile
+        self.healthy = False
+        self.lag: float | None = None
+        self.checked_at = 0.0
+
+    def check(self, max_lag: float):
+        """
+        Refresh replication lag. Replicas that lag too far, stopped replicating or
+        cannot be reached are skipped until the next successful check.
+        """
+        try:
+            with self.engine.connect() as connection:
+                row = connection.execute(text("SHOW REPLICA STATUS")).mappings().first()
+            self.lag = None if row is None else row.get("Seconds_Behind_Source")
+            self.healthy = self.lag is not None and self.lag <= max_lag
+        except Exception as e:
+            logger.warning(f"Replica {self.engine.url.host} lag check failed: {e}")
+            self.lag = None
+            self.healthy = False
+        finally:
+            self.checked_at = time.monotonic()
+
+
+class ReplicaSet:
+    """
+    Replicas are checked every `check_interval` seconds by a background thread started
+    with start(); pick() only reads the last result, so routing a query never waits on
+    a lag check.
+    """
+
+    def __init__(self, engines: list[Engine], max_lag: float, check_interval: float):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self._checker: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def start(self):
+        if not self.replicas or self._checker is not None:
+            return
+        self._stopped.clear()
+        self._checker = threading.Thread(target=self._check_loop, name="replica-lag", daemon=True)
+        self._checker.start()
+
+    def stop(self):
+        if self._checker is None:
+            return
+        self._stopped.set()
+        self._checker.join()
+        self._checker = None
+
+    def _check_loop(self):
+        while not self._stopped.is_set():
+            for replica in self.replicas:
+                replica.check(self.max_lag)
+            self._stopped.wait(self.check_interval)
+
+    def pick(self) -> Engine | None:
+        """
+        Next healthy replica in round-robin order, or None to fall back to the primary.
+        """
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+    def stats(self) -> list[dict]:
+        return [
+            {"host": replica.engine.url.host, "healthy": replica.healthy, "lag": replica.lag}
+            for replica in self.replicas
+        ]
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to a read replica until the session writes anything;
+    from then on (and for everything else) the primary is used, so a request
+    always reads its own writes. Locking reads (SELECT ... FOR UPDATE) count as
+    writes: a row lock taken on a replica serializes nothing.
+
+    All reads of a session go to the replica picked for its first one, so a request
+    never sees data go back in time by switching between replicas that lag differently.
+    """
+
+    def __init__(self, replicas: ReplicaSet | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = replicas
+        self.pinned_to_primary = False
+        # picked on the first read; None once picked means the primary serves the reads
+        self.replica: Engine | None = None
+        self._replica_picked = False
+
+    def use_primary(self):
+        self.pinned_to_primary = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+                self.replicas and not self.pinned_to_primary and not self._flushing
+                and isinstance(clause, Select) and not _locks_rows(clause)
+        ):
+            if not self._replica_picked:
+                self.replica = self.replicas.pick()
+                self._replica_picked = True
+            if self.replica is not None:
+                return self.replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+    def close(self):
+        super().close()
+        self.replica = None
+        self._replica_picked = False
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self.pinned_to_primary = True
+        super().flush(objects)
+
+    def execute(self, statement, *args, **kwargs):
+        if not isinstance(statement, Select) or _locks_rows(statement):
+            self.pinned_to_primary = True
+        return super().execute(statement, *args, **kwargs)
+
+
+def _locks_rows(statement: Select) -> bool:
+    return statement._for_update_arg is not None
@@ -0,0 +1,162 @@
+import time
+
+from sqlalchemy import Engine, event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from src.utils.metrics import Histogram, PrometheusWriter, register_collector
+
+
+class PoolMetrics:
+    def __init__(self, name: str, pool: Pool, recycle: int):
+        self.name = name
+        self.pool = pool
+        self.recycle = recycle
+
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_timeouts = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.pre_ping_failures = 0
+        self.recycles = 0
+        self.max_checked_out = 0
+        self.checkout_wait = Histogram()
+
+    def gauges(self) -> dict:
+        pool = self.pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # QueuePool counts overflow from -size; only connections beyond pool_size are overflow
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            **self.gauges(),
+            "max_checked_out": self.max_checked_out,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "checkout_timeouts": self.checkout_timeouts,
+            "invalidations": self.invalidations,
+            "soft_invalidations": self.soft_invalidations,
+            "pre_ping_failures": self.pre_ping_failures,
+            "recycles": self.recycles,
+            "checkout_wait_seconds": self.checkout_wait.stats(),
+        }
+
+
+pool_metrics: dict[str, PoolMetrics] = {}
+
+
+class _TimedCheckout:
+    """
+    Measures how long a checkout waits for a free connection (including connect time
+    for new ones). Pool events only fire once a connection is already handed out.
+    """
+
+    _metrics: PoolMetrics | None = None
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self._metrics is not None:
+                self._metrics.checkout_timeouts += 1
+            raise
+        finally:
+            if self._metrics is not None:
+                self._metrics.checkout_wait.observe(time.perf_counter() - started_at)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._metrics = self._metrics
+        if self._metrics is not None:
+            self._metrics.pool = pool
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine: Engine | AsyncEngine, name: str, recycle: int = -1) -> PoolMetrics:
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    metrics = PoolMetrics(name, engine.pool, recycle)
+    engine.pool._metrics = metrics
+    pool_metrics[name] = metrics
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+        gauges = metrics.gauges()
+        metrics.max_checked_out = max(metrics.max_checked_out, gauges.get("checked_out", 0))
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        metrics.checkins += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_connection, connection_record, exception):
+        metrics.invalidations += 1
+        # a failed pre-ping surfaces as InvalidatePoolError on the checked-out record
+        if isinstance(exception, exc.InvalidatePoolError):
+            metrics.pre_ping_failures += 1
+
+    @event.listens_for(engine, "soft_invalidate")
+    def _soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics.soft_invalidations += 1
+
+    @event.listens_for(engine, "close")
+    def _close(dbapi_connection, connection_record):
+        # pool_recycle closes aged connections right before reconnecting on checkout
+        if 0 <= metrics.recycle < time.time() - connection_record.starttime:
+            metrics.recycles += 1
+
+    return metrics
+
+
+def pool_stats() -> list[dict]:
+    return [metrics.stats() for metrics in pool_metrics.values()]
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    for metrics in pool_metrics.values():
+        pool = metrics.name
+        for key, value in metrics.gauges().items():
+            writer.gauge(f"db_pool_{key}", value, f"Connection pool {key.replace('_', ' ')}", pool=pool)
+        writer.gauge("db_pool_max_checked_out", metrics.max_checked_out,
+                     "Highest number of simultaneously checked out connections", pool=pool)
+        writer.counter("db_pool_connects_total", metrics.connects, "New DBAPI connections", pool=pool)
+        writer.counter("db_pool_checkouts_total", metrics.checkouts, "Connection checkouts", pool=pool)
+        writer.counter("db_pool_checkins_total", metrics.checkins, "Connection checkins", pool=pool)
+        writer.counter("db_pool_checkout_timeouts_total", metrics.checkout_timeouts,
+                       "Checkouts that hit pool_timeout", pool=pool)
+        writer.counter("db_pool_invalidations_total", metrics.invalidations, "Invalidated connections", pool=pool)
+        writer.counter("db_pool_soft_invalidations_total", metrics.soft_invalidations,
+                       "Soft invalidated connections", pool=pool)
+        writer.counter("db_pool_pre_ping_failures_total", metrics.pre_ping_failures,
+                       "Checkouts whose pre-ping found a dead connection", pool=pool)
+        writer.counter("db_pool_recycles_total", metrics.recycles,
+                       "Connections closed because they exceeded pool_recycle", pool=pool)
+        writer.histogram("db_pool_checkout_wait_seconds", metrics.checkout_wait,
+                         "Time spent waiting for a connection", pool=pool)
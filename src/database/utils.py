@@ -6,5 +6,5 @@ from src.database.database import SessionLocal
 
 def add_test_data():
     db: Session = SessionLocal()
-    create_user(db, "test-name", "test-username", "test-password", "test-user-id")
+    create_user(db, "test-name", "test-username", "test-password")
     db.close()
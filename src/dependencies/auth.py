@@ -1,36 +1,71 @@
+import asyncio
 import os
 from typing import Annotated
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from src.crud import principal_cache
+from src.crud.loading import UserLoad, user_load_options
+from src.crud.token_version import get_token_version
 from src.database import models
 from src.dependencies.basic import get_db
-from src.utils.credentials import verify_password, decode_token
-from src.utils.handler import handle_error, handle_none_value
+from src.schemas.basic import Principal
+from src.utils.credentials import verify_password_async, decode_token, create_access_token
+from src.utils.handler import handle_error, handle_none_value, handle_async_error
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/public/auth/login", auto_error=True)
 
 API_KEY = os.getenv("ADMIN_API_KEY", "admin")
 SUPER_ADMIN_API_KEY = os.getenv("SUPER_ADMIN_API_KEY", "admin.root")
 
+# "subject": tokens only carry the username and every request loads the user
+# "claims": tokens also carry id, name and token version so get_current_principal can skip the lookup
+AUTH_TOKEN_MODE = os.getenv("AUTH_TOKEN_MODE", "subject").lower()
+
 api_key_header = APIKeyHeader(name="X-ADMIN-TOKEN", auto_error=True, scheme_name="X-ADMIN-TOKEN")
 super_admin_api_key_header = APIKeyHeader(name="X-SUPER-ADMIN-TOKEN", auto_error=True,
                                           scheme_name="X-SUPER-ADMIN-TOKEN")
 
 
+def _user_by_username(username: str, load: UserLoad):
+    # shared by the sync lookup (authenticated requests) and the async one (login)
+    return (
+        select(models.User)
+        .join(models.User.account)
+        .options(*user_load_options(load, account_joined=True))
+        .filter(models.UserAccount.username == username)
+    )
+
+
 @handle_none_value("User")
 @handle_error
-def get_user_by_username(db: Session, username: str) -> models.User | None:
-    user = db.query(models.User).join(models.UserAccount).filter_by(username=username).first()
-    return user
+def get_user_by_username(
+        db: Session,
+        username: str,
+        load: UserLoad = UserLoad.ACCOUNT
+) -> models.User | None:
+    return db.execute(_user_by_username(username, load)).unique().scalars().first()
 
 
-def authenticate_user(db: Session, username: str, password: str) -> models.User:
-    user = get_user_by_username(db, username)
+@handle_none_value("User")
+@handle_async_error
+async def get_user_by_username_async(
+        db: AsyncSession,
+        username: str,
+        load: UserLoad = UserLoad.ACCOUNT
+) -> models.User | None:
+    result = await db.execute(_user_by_username(username, load))
+    return result.unique().scalars().first()
+
+
+async def authenticate_user_async(db: AsyncSession, username: str, password: str) -> models.User:
+    user = await get_user_by_username_async(db, username)
     truth_password = user.account[0].password
-    if not verify_password(password, truth_password):
+    if not await verify_password_async(password, truth_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -38,11 +73,32 @@ def authenticate_user(db: Session, username: str, password: str) -> models.User:
     return user
 
 
-async def get_current_user(
-        token: Annotated[str, Depends(oauth2_scheme)],
-        db: Session = Depends(get_db)
-) -> models.User:
-    payload = decode_token(token)
+def issue_access_token(user: models.User) -> str:
+    data = {"sub": user.account[0].username}
+    if AUTH_TOKEN_MODE == "claims":
+        data.update({"uid": user.id, "name": user.name, "ver": user.token_version})
+    return create_access_token(data)
+
+
+async def check_token_version(payload: dict) -> bool:
+    """
+    Reject revoked claims tokens. Returns False when the version could not be checked.
+    """
+    if "ver" not in payload:
+        return False
+    version = await get_token_version(payload["uid"])
+    if version is None:
+        return False
+    if payload["ver"] != version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return True
+
+
+def token_subject(payload: dict) -> str:
     username: str = payload.get("sub")
     if username is None:
         raise HTTPException(
@@ -50,12 +106,52 @@ async def get_current_user(
             detail="Could not validate credentials (username) not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return username
+
+
+async def load_user(db: Session, payload: dict) -> models.User:
+    username = token_subject(payload)
+    user = await principal_cache.get_cached_user(db, username)
+    if user is None:
+        # concurrent misses for the same user share one query, run off the event loop
+        async def loader() -> models.User:
+            return await asyncio.to_thread(get_user_by_username, db, username)
 
-    user = get_user_by_username(db, username)
+        snapshot = await principal_cache.load_snapshot(username, loader)
+        user = principal_cache.restore_user(db, snapshot)
 
     return user
 
 
+async def get_current_user(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        db: Session = Depends(get_db)
+) -> models.User:
+    payload = decode_token(token)
+    await check_token_version(payload)
+    return await load_user(db, payload)
+
+
+async def get_current_principal(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        db: Session = Depends(get_db)
+) -> Principal:
+    """
+    Identity of the caller for routes that do not need the ORM entity.
+    Claims tokens are trusted after a token version check; other tokens fall back to a user lookup.
+    """
+    payload = decode_token(token)
+    if await check_token_version(payload):
+        return Principal(
+            id=payload["uid"],
+            name=payload["name"],
+            username=payload["sub"],
+            token_version=payload["ver"],
+        )
+
+    return Principal.from_model(await load_user(db, payload))
+
+
 async def get_admin_user(api_key: Annotated[str, Depends(api_key_header)] = None):
     if api_key != API_KEY:
         raise HTTPException(
@@ -1,20 +1,17 @@
-import os
-
 from redis import StrictRedis as Redis
+from redis.asyncio import StrictRedis as AsyncRedis
 
-from src.database.database import SessionLocal
+from src.database.database import SessionLocal, AsyncSessionLocal
+from src.database.redis import get_async_redis, get_redis
 
 
 def get_redis_client() -> Redis:
-    r = Redis(
-        host=os.getenv('REDIS_HOST', 'redis'),
-        port=int(os.getenv('REDIS_PORT', '6379')),
-        decode_responses=True
-    )
-    try:
-        yield r
-    finally:
-        r.close()
+    # connections come from the shared per-process pool; nothing to open or close per request
+    return get_redis()
+
+
+async def get_async_redis_client() -> AsyncRedis:
+    return get_async_redis()
 
 
 def get_db():
@@ -23,3 +20,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,102 @@
+"""
+CPU-bound file inspection, run in the job worker's process pool. Only the standard
+library is used, so every function here must stay picklable and free of app state.
+"""
+import hashlib
+import struct
+
+READ_SIZE = 1024 * 1024
+
+# leading bytes -> content type
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"OggS", "audio/ogg"),
+    (b"ID3", "audio/mpeg"),
+    (b"fLaC", "audio/flac"),
+    (b"\x1aE\xdf\xa3", "video/webm"),
+]
+
+
+def sniff_content_type(head: bytes) -> str | None:
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[4:8] == b"ftyp":
+        return "image/heic" if head[8:12] in (b"heic", b"heix", b"mif1") else "video/mp4"
+    return None
+
+
+def image_size(head: bytes, content_type: str | None) -> tuple[int, int] | None:
+    """
+    Width and height from the image header, without decoding the image.
+    """
+    try:
+        if content_type == "image/png" and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if content_type == "image/gif":
+            return struct.unpack("<HH", head[6:10])
+        if content_type == "image/webp":
+            chunk = head[12:16]
+            if chunk == b"VP8X":
+                return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if content_type == "image/jpeg":
+            return _jpeg_size(head)
+    except struct.error:
+        return None
+    return None
+
+
+def _jpeg_size(head: bytes) -> tuple[int, int] | None:
+    # walk the segments up to the first start-of-frame marker
+    offset = 2
+    while offset + 9 < len(head):
+        if head[offset] != 0xFF:
+            return None
+        marker = head[offset + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        length = struct.unpack(">H", head[offset + 2:offset + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", head[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def analyze_file(path: str, head_size: int = 64 * 1024) -> dict:
+    """
+    SHA-256, size, sniffed content type and, for images, dimensions of a local file.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b""
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_SIZE):
+            if len(head) < head_size:
+                head += chunk[:head_size - len(head)]
+            sha256.update(chunk)
+            size += len(chunk)
+
+    content_type = sniff_content_type(head)
+    metadata = {"sha256": sha256.hexdigest()}
+    dimensions = image_size(head, content_type)
+    if dimensions is not None:
+        metadata["width"], metadata["height"] = dimensions
+    return {"size": size, "detected_type": content_type, "file_metadata": metadata}
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import random
+import time
+
+from redis.asyncio import StrictRedis as AsyncRedis
+
+from src.database import models
+from src.database.redis import get_async_redis
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# A claimed job goes back to the queue if its worker doesn't ack or extend it within this many seconds
+JOBS_VISIBILITY_TIMEOUT = float(os.getenv("JOBS_VISIBILITY_TIMEOUT", "60"))
+# attempts before a job moves to the dead-letter list
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+# retry n waits about JOBS_BACKOFF_BASE * 2^(n-1) seconds, at most JOBS_BACKOFF_MAX, with full jitter
+JOBS_BACKOFF_BASE = float(os.getenv("JOBS_BACKOFF_BASE", "2"))
+JOBS_BACKOFF_MAX = float(os.getenv("JOBS_BACKOFF_MAX", "600"))
+# dead-lettered jobs are kept this long for inspection and requeue_dead
+JOBS_DEAD_TTL = int(os.getenv("JOBS_DEAD_TTL", str(7 * 24 * 3600)))
+
+REDIS_KEY_PREFIX = "jobs:"
+
+# Due retries and jobs whose visibility timeout lapsed (their worker died) go back to the
+# ready list, then one job moves from ready to processing with a new deadline. Atomic, so
+# two workers never claim the same job.
+_CLAIM = """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call("zrangebyscore", KEYS[2], "-inf", now, "LIMIT", 0, 100)) do
+    redis.call("zrem", KEYS[2], id)
+    redis.call("lpush", KEYS[1], id)
+end
+for _, id in ipairs(redis.call("zrangebyscore", KEYS[3], "-inf", now, "LIMIT", 0, 100)) do
+    redis.call("zrem", KEYS[3], id)
+    redis.call("rpush", KEYS[1], id)
+end
+local id = redis.call("rpop", KEYS[1])
+if id then
+    redis.call("zadd", KEYS[3], ARGV[2], id)
+end
+return id
+"""
+
+
+def backoff(attempts: int) -> float:
+    return random.uniform(0, min(JOBS_BACKOFF_MAX, JOBS_BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+class JobQueue:
+    """
+    At-least-once job queue in Redis. Job bodies are stored under jobs:job:{id}; the ids
+    move between a ready list, a delayed set (retries, scored by due time), a processing
+    set (scored by visibility deadline) and a dead-letter list.
+
+    Tasks must be idempotent: a job whose worker stalls past the visibility timeout runs again.
+    """
+
+    def __init__(self, name: str = "default", redis: AsyncRedis | None = None):
+        self.name = name
+        self._redis = redis
+        prefix = f"{REDIS_KEY_PREFIX}{name}:"
+        self.ready_key = prefix + "ready"
+        self.delayed_key = prefix + "delayed"
+        self.processing_key = prefix + "processing"
+        self.dead_key = prefix + "dead"
+
+    @property
+    def redis(self) -> AsyncRedis:
+        return self._redis or get_async_redis()
+
+    @staticmethod
+    def job_key(job_id: str) -> str:
+        return f"{REDIS_KEY_PREFIX}job:{job_id}"
+
+    async def enqueue(self, task: str, *args, max_attempts: int = JOBS_MAX_ATTEMPTS) -> str:
+        return (await self.enqueue_many(task, [args], max_attempts=max_attempts))[0]
+
+    async def enqueue_many(self, task: str, args_list: list, max_attempts: int = JOBS_MAX_ATTEMPTS) -> list[str]:
+        """
+        Queue one job per args tuple, in a single round trip.
+        """
+        now = time.time()
+        jobs = [
+            {"id": models.new_id(), "task": task, "args": list(args), "attempts": 0, "max_attempts": max_attempts,
+             "enqueued_at": now, "last_error": None}
+            for args in args_list
+        ]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for job in jobs:
+                pipe.set(self.job_key(job["id"]), json.dumps(job))
+            pipe.lpush(self.ready_key, *[job["id"] for job in jobs])
+            await pipe.execute()
+        return [job["id"] for job in jobs]
+
+    async def claim(self) -> dict | None:
+        """
+        Take the next job, or None if there is nothing to do. The caller must ack or fail
+        it, and extend it while it runs longer than the visibility timeout.
+        """
+        redis = self.redis
+        now = time.time()
+        job_id = await redis.eval(_CLAIM, 3, self.ready_key, self.delayed_key, self.processing_key,
+                                  now, now + JOBS_VISIBILITY_TIMEOUT)
+        if job_id is None:
+            return None
+
+        raw = await redis.get(self.job_key(job_id))
+        if raw is None:
+            # acked by a worker that outlived its visibility timeout
+            await redis.zrem(self.processing_key, job_id)
+            return None
+        job = json.loads(raw)
+        if job["attempts"] >= job["max_attempts"]:
+            # its workers keep dying before they can fail it
+            await self.dead_letter(job, job["last_error"] or "Visibility timeout exceeded")
+            return None
+        job["attempts"] += 1
+        await redis.set(self.job_key(job["id"]), json.dumps(job))
+        return job
+
+    async def extend(self, job: dict) -> bool:
+        """
+        Push the visibility deadline back. False if the job was taken away meanwhile.
+        """
+        return bool(await self.redis.zadd(
+            self.processing_key, {job["id"]: time.time() + JOBS_VISIBILITY_TIMEOUT}, xx=True, ch=True
+        ))
+
+    async def ack(self, job: dict):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.processing_key, job["id"])
+            pipe.delete(self.job_key(job["id"]))
+            await pipe.execute()
+
+    async def fail(self, job: dict, error: str):
+        """
+        Schedule a retry after a backoff, or dead-letter the job on its last attempt.
+        """
+        if job["attempts"] >= job["max_attempts"]:
+            await self.dead_letter(job, error)
+            return
+        job["last_error"] = error
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.job_key(job["id"]), json.dumps(job))
+            pipe.zrem(self.processing_key, job["id"])
+            pipe.zadd(self.delayed_key, {job["id"]: time.time() + backoff(job["attempts"])})
+            await pipe.execute()
+
+    async def postpone(self, job: dict, delay: float):
+        """
+        Put a job that couldn't start back for `delay` seconds, without counting the attempt.
+        """
+        job["attempts"] -= 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.job_key(job["id"]), json.dumps(job))
+            pipe.zrem(self.processing_key, job["id"])
+            pipe.zadd(self.delayed_key, {job["id"]: time.time() + delay})
+            await pipe.execute()
+
+    async def dead_letter(self, job: dict, error: str):
+        logger.error(f"Job {job['id']} ({job['task']}) failed after {job['attempts']} attempts: {error}")
+        job["last_error"] = error
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.job_key(job["id"]), json.dumps(job), ex=JOBS_DEAD_TTL)
+            pipe.zrem(self.processing_key, job["id"])
+            pipe.lpush(self.dead_key, job["id"])
+            await pipe.execute()
+
+    async def dead_jobs(self, limit: int = 100) -> list[dict]:
+        redis = self.redis
+        job_ids = await redis.lrange(self.dead_key, 0, limit - 1)
+        raws = await redis.mget([self.job_key(job_id) for job_id in job_ids]) if job_ids else []
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    async def requeue_dead(self, limit: int = 100) -> int:
+        """
+        Give dead-lettered jobs a fresh set of attempts, oldest first. Returns how many were requeued.
+        """
+        redis = self.redis
+        requeued = 0
+        for _ in range(limit):
+            job_id = await redis.rpop(self.dead_key)
+            if job_id is None:
+                break
+            raw = await redis.get(self.job_key(job_id))
+            if raw is None:
+                continue
+            job = json.loads(raw)
+            job["attempts"] = 0
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.set(self.job_key(job["id"]), json.dumps(job))
+                pipe.lpush(self.ready_key, job["id"])
+                await pipe.execute()
+            requeued += 1
+        return requeued
+
+    async def stats(self) -> dict:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(self.ready_key)
+            pipe.zcard(self.delayed_key)
+            pipe.zcard(self.processing_key)
+            pipe.llen(self.dead_key)
+            ready, delayed, processing, dead = await pipe.execute()
+        return {"queue": self.name, "ready": ready, "delayed": delayed, "processing": processing, "dead": dead}
+
+
+job_queue = JobQueue()
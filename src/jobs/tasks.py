@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Awaitable, Callable
+
+from redis.exceptions import RedisError
+
+from src.crud import blob as blob_crud
+from src.database.database import SessionLocal
+from src.jobs.analyze import analyze_file
+from src.jobs.queue import job_queue
+from src.utils.executor import executor_from_env
+from src.utils.s3 import delete_from_s3, download_from_s3, key_from_public_url, run_s3
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# Queue post-upload processing for new blobs; turn off when no job worker is deployed
+BLOB_PROCESSING_ENABLED = os.getenv("BLOB_PROCESSING_ENABLED", "true").lower() == "true"
+# where objects are downloaded to while they are analyzed
+JOBS_TMP_DIR = os.getenv("JOBS_TMP_DIR") or tempfile.gettempdir()
+
+# CPU-bound task work (hashing, parsing) runs here, off the worker's event loop
+cpu_pool = executor_from_env("jobs-cpu", "JOBS_CPU", default_workers=os.cpu_count() or 1, default_kind="process")
+
+TASKS: dict[str, Callable[..., Awaitable]] = {}
+
+
+def task(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Register a coroutine function as a job task under its name. Arguments must be JSON serializable.
+    """
+    TASKS[func.__name__] = func
+    return func
+
+
+@task
+async def process_blob(blob_id: str):
+    """
+    Checksum, sniff and extract metadata from a blob's object and write the results to its row.
+    """
+    # database work runs in threads: a slow query must not stall the heartbeats of the other jobs
+    found = await asyncio.to_thread(_find_work, blob_id)
+    if found is None:
+        return
+    object_key, analysis = found
+
+    if analysis is None:
+        analysis = await _analyze_object(object_key)
+
+    await asyncio.to_thread(_save_analysis, blob_id, analysis)
+
+
+def _find_work(blob_id: str) -> tuple[str, dict | None] | None:
+    # the blob's object key and, if another blob sharing it was processed, that analysis
+    with SessionLocal() as db:
+        # queued right after the commit, a replica may not have the row yet
+        db.use_primary()
+        blob = blob_crud.get_blob(db, blob_id)
+        if blob is None or blob.processed_at is not None:
+            # deleted meanwhile, or a redelivered job
+            return None
+        object_key = blob.object_key or key_from_public_url(blob.url)
+        if object_key is None:
+            logger.warning(f"Blob {blob_id} has no object in the bucket, not processing it")
+            return None
+        analysis = None
+        if blob.digest is not None:
+            analysis = blob_crud.find_object_analysis(db, blob.digest, blob.size, object_key)
+        return object_key, analysis
+
+
+def _save_analysis(blob_id: str, analysis: dict):
+    with SessionLocal() as db:
+        blob_crud.save_blob_analysis(db, blob_id, analysis)
+
+
+async def _analyze_object(object_key: str) -> dict:
+    fd, path = tempfile.mkstemp(prefix="job-", dir=JOBS_TMP_DIR)
+    os.close(fd)
+    try:
+        await run_s3(download_from_s3, object_key, path)
+        return await cpu_pool.run(analyze_file, path)
+    finally:
+        os.unlink(path)
+
+
+async def schedule_blob_processing(blob_ids: list[str]):
+    """
+    Queue process_blob for blobs that were just committed. The upload succeeded either
+    way, so a Redis failure is only logged.
+    """
+    if not BLOB_PROCESSING_ENABLED or not blob_ids:
+        return
+    try:
+        await job_queue.enqueue_many("process_blob", [(blob_id,) for blob_id in blob_ids])
+    except RedisError as e:
+        logger.error(f"Failed to queue processing of blobs {blob_ids}: {e}")
+
+
+async def finish_spooled_upload(entry: dict, error: str | None):
+    """
+    upload_spool callback: mark the blob ready and queue its processing, or mark it failed.
+    """
+    found = await asyncio.to_thread(_finish_pending, entry["blob_id"], "ready" if error is None else "failed")
+    if not found:
+        if error is None:
+            # deleted while it was uploading, nothing references the object
+            await run_s3(delete_from_s3, entry["key"])
+        return
+    if error is None:
+        await schedule_blob_processing([entry["blob_id"]])
+
+
+def _finish_pending(blob_id: str, blob_status: str) -> bool:
+    with SessionLocal() as db:
+        return blob_crud.finish_pending_blob(db, blob_id, blob_status)
+
+
+async def spooled_upload_pending(entry: dict) -> bool:
+    """
+    upload_spool callback for files left by a previous process: upload them again only if
+    their blob was committed and is still pending.
+    """
+    return await asyncio.to_thread(_blob_pending, entry["blob_id"])
+
+
+def _blob_pending(blob_id: str) -> bool:
+    with SessionLocal() as db:
+        # the row may have been committed just before the restart
+        db.use_primary()
+        blob = blob_crud.get_blob(db, blob_id)
+        return blob is not None and blob.status == "pending"
@@ -0,0 +1,127 @@
+"""
+Job worker: claims jobs from the Redis queue and runs their tasks.
+
+    python -m src.jobs.worker
+
+Run as many as needed; they share the queue. Stop with SIGTERM: claimed jobs get
+JOBS_SHUTDOWN_GRACE seconds to finish, unfinished ones are redelivered after their
+visibility timeout.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from redis.exceptions import RedisError
+
+from src.database.redis import close_redis, init_redis
+from src.jobs.queue import JOBS_VISIBILITY_TIMEOUT, JobQueue, job_queue
+from src.jobs.tasks import TASKS, cpu_pool
+from src.utils.executor import ExecutorSaturated
+from src.utils.s3 import s3_pool
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# jobs one worker runs at the same time
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "8"))
+# how long an idle worker waits before looking for jobs again
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1"))
+# a task running longer than this is cancelled and counts as a failed attempt; a blocking call
+# it was waiting for on a thread or process pool can't be interrupted and still runs to the end
+JOBS_TASK_TIMEOUT = float(os.getenv("JOBS_TASK_TIMEOUT", "600"))
+JOBS_SHUTDOWN_GRACE = float(os.getenv("JOBS_SHUTDOWN_GRACE", "30"))
+
+
+async def _keep_visible(queue: JobQueue, job: dict):
+    while True:
+        await asyncio.sleep(JOBS_VISIBILITY_TIMEOUT / 3)
+        try:
+            if not await queue.extend(job):
+                logger.warning(f"Job {job['id']} was redelivered while still running")
+                return
+        except RedisError as e:
+            logger.warning(f"Extending job {job['id']} failed: {e}")
+
+
+async def run_job(queue: JobQueue, job: dict):
+    func = TASKS.get(job["task"])
+    heartbeat = asyncio.create_task(_keep_visible(queue, job))
+    try:
+        if func is None:
+            await queue.dead_letter(job, f"Unknown task {job['task']}")
+            return
+        try:
+            await asyncio.wait_for(func(*job["args"]), JOBS_TASK_TIMEOUT)
+        except ExecutorSaturated as e:
+            # the pool is busy, nothing went wrong with the job itself
+            logger.info(f"Job {job['id']} ({job['task']}) postponed: {e}")
+            await queue.postpone(job, e.retry_after)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Job {job['id']} ({job['task']}) attempt {job['attempts']} failed: {error}")
+            await queue.fail(job, error)
+        else:
+            await queue.ack(job)
+    except RedisError as e:
+        # the job stays in processing and is redelivered after its visibility timeout
+        logger.error(f"Finishing job {job['id']} failed: {e}")
+    finally:
+        heartbeat.cancel()
+
+
+async def work(queue: JobQueue, stop: asyncio.Event):
+    slots = asyncio.Semaphore(JOBS_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+
+    def finished(task: asyncio.Task):
+        running.discard(task)
+        slots.release()
+
+    while not stop.is_set():
+        await slots.acquire()
+        job = None
+        if not stop.is_set():
+            try:
+                job = await queue.claim()
+            except RedisError as e:
+                logger.error(f"Claiming a job failed: {e}")
+        if job is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop.wait(), JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = asyncio.create_task(run_job(queue, job))
+        running.add(task)
+        task.add_done_callback(finished)
+
+    if running:
+        logger.info(f"Waiting up to {JOBS_SHUTDOWN_GRACE}s for {len(running)} running jobs")
+        _, pending = await asyncio.wait(running, timeout=JOBS_SHUTDOWN_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def main():
+    await init_redis()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"Job worker started: queue {job_queue.name}, concurrency {JOBS_CONCURRENCY}, tasks {sorted(TASKS)}")
+    try:
+        await work(job_queue, stop)
+    finally:
+        await close_redis()
+        cpu_pool.shutdown()
+        s3_pool.shutdown()
+    logger.info("Job worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
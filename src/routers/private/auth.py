@@ -2,15 +2,17 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends
 
-from src.database import models
-from src.dependencies.auth import get_current_user
+from src.dependencies.auth import get_current_principal
 from src.schemas import base
+from src.schemas.basic import Principal
+from src.utils.response_cache import cache_response
 
 router = APIRouter()
 
 
 @router.get('/me', response_model=base.UserInfo)
+@cache_response()
 async def me(
-        user: Annotated[models.User, Depends(get_current_user)]
+        principal: Annotated[Principal, Depends(get_current_principal)]
 ):
-    return base.UserInfo.from_model(user)
+    return base.UserInfo.from_principal(principal)
@@ -1,49 +1,496 @@
-from typing import Annotated, List
+import asyncio
+import logging
+import os
+from typing import Annotated
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, UploadFile
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 
+from src.crud import blob as blob_crud, pending_upload, resumable_upload
 from src.database import models
-from src.dependencies.auth import get_current_user
+from src.database.profiling import allow_repeats
+from src.dependencies.auth import get_current_principal
 from src.dependencies.basic import get_db
+from src.jobs.tasks import schedule_blob_processing
 from src.schemas import base
-from src.utils.s3 import upload_local_to_s3, save_upload_files_locally
+from src.schemas.basic import Principal, UploadedFile
+from src.utils.download import object_response
+from src.utils.response_cache import cache_response
+from src.utils.s3 import (
+    S3_MAX_PARTS, S3_MULTIPART_PART_SIZE, abort_multipart_upload, complete_multipart_upload, create_multipart_upload,
+    delete_from_s3, head_from_s3, key_from_public_url, presigned_post, presigned_put, public_url, run_s3,
+)
+from src.utils.spool import get_progress, upload_spool
+from src.utils.upload import (
+    UPLOAD_MAX_FILES, UPLOAD_MAX_SIZE, append_parts_to_s3, stream_files_to_s3, upload_request_body,
+)
+from src.utils.utils import wrap_logger
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
 
+BLOB_PAGE_SIZE = int(os.getenv("BLOB_PAGE_SIZE", "50"))
+BLOB_PAGE_MAX_SIZE = int(os.getenv("BLOB_PAGE_MAX_SIZE", "200"))
 
-@router.post("/blob", response_model=base.BlobInfo)
+
+def _stored_object_finder(db: Session, max_files: int = 1):
+    async def find_stored(digest: str, size: int) -> str | None:
+        # files arrive one by one, each is looked up by digest before it is stored
+        with allow_repeats(max_files):
+            return blob_crud.find_stored_object(db, digest, size)
+
+    return find_stored
+
+
+def _blob_entry(file: UploadedFile) -> dict:
+    return dict(
+        filename=file.original_file_name,
+        content_type=file.content_type,
+        url=file.url,
+        object_key=file.key,
+        digest=file.digest,
+        size=file.size,
+        shared=file.deduplicated,
+    )
+
+
+async def _create_blobs(db: Session, user_id: str, files: list[UploadedFile]) -> list[models.Blob]:
+    # objects this request stored are deleted again if they can't be registered; shared ones stay
+    try:
+        return blob_crud.create_user_blobs(db, user_id, [_blob_entry(file) for file in files])
+    except BaseException:
+        await asyncio.gather(*[_discard_object(file.key) for file in files if not file.deduplicated])
+        raise
+
+
+async def _discard_object(key: str):
+    try:
+        await run_s3(delete_from_s3, key)
+    except Exception as e:
+        logger.warning(f"Deleting unregistered object {key} failed: {e}")
+
+
+async def _upload_to_spool(db: Session, user_id: str, request: Request) -> models.Blob | None:
+    # the whole body is reserved up front; without a length or room in the spool, the caller stores it directly
+    content_length = request.headers.get("Content-Length", "")
+    if not content_length.isdigit() or not upload_spool.reserve(int(content_length)):
+        return None
+
+    writers = {}
+
+    def spool_writer(s3_path: str, content_type: str):
+        writers[s3_path] = upload_spool.writer(s3_path, content_type)
+        return writers[s3_path]
+
+    try:
+        uploaded_file = (await stream_files_to_s3(
+            request, lambda extension: f"user/{str(uuid4())}.{extension}",
+            find_stored=_stored_object_finder(db), writer_for=spool_writer,
+        ))[0]
+    finally:
+        upload_spool.release(int(content_length))
+
+    # a deduplicated file is stored already and never touched the spool
+    writer = None if uploaded_file.deduplicated else writers[uploaded_file.key]
+    entry = _blob_entry(uploaded_file) | {"id": models.new_id(), "status": "ready" if writer is None else "pending"}
+    try:
+        # recorded before the commit: a restart in between finds the file, and drops it if no row exists
+        spooled = await upload_spool.record(writer, entry["id"]) if writer is not None else None
+        new_blob = blob_crud.create_user_blobs(db, user_id, [entry])[0]
+    except BaseException:
+        if writer is not None:
+            await writer.delete()
+        raise
+    if spooled is not None:
+        upload_spool.submit(spooled)
+    return new_blob
+
+
+@router.post("/blob", response_model=base.BlobInfo, openapi_extra=upload_request_body("file"), responses={
+    202: {"model": base.BlobInfo, "description": "Received, still being stored (Prefer: respond-async)"},
+})
 async def upload_image(
-        user: Annotated[models.User, Depends(get_current_user)],
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        request: Request,
+        response: Response,
+        prefer: Annotated[str | None, Header(description="respond-async: answer once the file is received")] = None,
+):
+    """
+    Upload one file as multipart/form-data field "file". The body is streamed to S3 as it arrives.
+
+    With Prefer: respond-async the file is received into the local spool instead, and 202
+    returns a pending blob while it is stored in the background; poll /blob/{blob_id}/status.
+    If the spool can't take the request, it is stored directly and answered with 200.
+    """
+    if prefer is not None and "respond-async" in prefer.lower():
+        new_blob = await _upload_to_spool(db, principal.id, request)
+        if new_blob is not None:
+            if new_blob.status == "pending":
+                response.status_code = status.HTTP_202_ACCEPTED
+                response.headers["Preference-Applied"] = "respond-async"
+                response.headers["Location"] = f"{request.url.path}/{new_blob.id}/status"
+            else:
+                await schedule_blob_processing([new_blob.id])
+            return base.BlobInfo.from_model(new_blob)
+
+    uploaded_file = (await stream_files_to_s3(
+        request, lambda extension: f"user/{str(uuid4())}.{extension}", find_stored=_stored_object_finder(db)
+    ))[0]
+
+    new_blob = (await _create_blobs(db, principal.id, [uploaded_file]))[0]
+    await schedule_blob_processing([new_blob.id])
+
+    return base.BlobInfo.from_model(new_blob)
+
+
+@router.post("/blobs", response_model=base.BlobUploadResults, openapi_extra=upload_request_body("files", multiple=True),
+             responses={207: {"model": base.BlobUploadResults, "description": "Some files failed"}})
+async def upload_images(
+        principal: Annotated[Principal, Depends(get_current_principal)],
         db: Annotated[Session, Depends(get_db)],
-        file: UploadFile,
+        request: Request,
+        response: Response,
 ):
-    uploaded_files = save_upload_files_locally(file)
-    url = upload_local_to_s3(
-        uploaded_files[0].path,
-        f"user/{str(uuid4())}.{uploaded_files[0].extension}",
-        file.content_type
+    """
+    Upload up to UPLOAD_MAX_FILES files as multipart/form-data field "files". Files are stored
+    concurrently and reported one by one; if any failed the status is 207.
+    """
+    uploaded_files = await stream_files_to_s3(
+        request,
+        lambda extension: f"user/{str(uuid4())}.{extension}",
+        field="files",
+        max_files=UPLOAD_MAX_FILES,
+        fail_fast=False,
+        find_stored=_stored_object_finder(db, UPLOAD_MAX_FILES),
     )
 
-    new_blob = models.Blob(
-        id=str(uuid4()),
-        filename=file.filename,
-        content_type=file.content_type,
-        url=url
+    stored = [file for file in uploaded_files if file.error is None]
+    new_blobs = await _create_blobs(db, principal.id, stored) if stored else []
+    await schedule_blob_processing([blob.id for blob in new_blobs])
+    blobs = iter(new_blobs)
+
+    items = [
+        base.BlobUploadResult(
+            filename=file.original_file_name,
+            size=file.size,
+            blob=base.BlobInfo.from_model(next(blobs)) if file.error is None else None,
+            error=file.error,
+        )
+        for file in uploaded_files
+    ]
+    if len(stored) < len(uploaded_files):
+        response.status_code = status.HTTP_207_MULTI_STATUS
+    return base.BlobUploadResults(items=items)
+
+
+@router.post("/blob/uploads", response_model=base.PresignedUpload)
+async def create_presigned_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        upload: base.PresignedUploadRequest,
+):
+    """
+    Phase one of a direct-to-bucket upload: a presigned POST policy or PUT URL for a server-chosen key.
+    Upload the file to the bucket with it, then call /blob/uploads/{upload_id}/complete.
+    """
+    if upload.size is not None and upload.size > UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="File too large")
+    if upload.method == "put" and upload.size is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="size is required for PUT uploads")
+
+    extension = upload.filename.split(".")[-1]
+    s3_path = f"user/{str(uuid4())}.{extension}"
+    expires_in = pending_upload.PRESIGNED_UPLOAD_EXPIRES
+
+    upload_id = await pending_upload.register_upload(
+        principal.id, s3_path, upload.filename, upload.content_type, UPLOAD_MAX_SIZE, upload.size
     )
 
-    db.add(new_blob)
-    db.flush()
-    user.blobs.append(new_blob)
+    if upload.method == "post":
+        post = presigned_post(s3_path, upload.content_type, UPLOAD_MAX_SIZE, expires_in)
+        return base.PresignedUpload(
+            upload_id=upload_id, method="post", url=post["url"], fields=post["fields"], expires_in=expires_in
+        )
+    return base.PresignedUpload(
+        upload_id=upload_id,
+        method="put",
+        url=presigned_put(s3_path, upload.content_type, upload.size, expires_in),
+        headers={"Content-Type": upload.content_type, "Content-Length": str(upload.size)},
+        expires_in=expires_in,
+    )
 
-    db.commit()
+
+@router.post("/blob/resumable", response_model=base.ResumableUpload, status_code=status.HTTP_201_CREATED)
+async def create_resumable_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        upload: base.ResumableUploadRequest,
+        request: Request,
+        response: Response,
+):
+    """
+    Start a resumable upload. Send the file with PATCH /blob/resumable/{upload_id} in one or
+    more chunks, check progress with HEAD after a dropped connection, then call .../complete.
+    """
+    if upload.size > UPLOAD_MAX_SIZE or upload.size > S3_MULTIPART_PART_SIZE * S3_MAX_PARTS:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="File too large")
+
+    extension = upload.filename.split(".")[-1]
+    s3_path = f"user/{str(uuid4())}.{extension}"
+    s3_upload_id = await run_s3(create_multipart_upload, s3_path, upload.content_type)
+    upload_id = await resumable_upload.create_session(
+        principal.id, s3_path, s3_upload_id, upload.filename, upload.content_type, upload.size, S3_MULTIPART_PART_SIZE
+    )
+
+    response.headers["Location"] = f"{request.url.path}/{upload_id}"
+    return base.ResumableUpload(
+        upload_id=upload_id,
+        offset=0,
+        size=upload.size,
+        part_size=S3_MULTIPART_PART_SIZE,
+        expires_in=resumable_upload.RESUMABLE_UPLOAD_EXPIRES,
+    )
+
+
+@router.head("/blob/resumable/{upload_id}")
+async def get_resumable_upload_offset(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        upload_id: str,
+):
+    """
+    Progress of a resumable upload: Upload-Offset is where the next chunk must start.
+    """
+    session = await resumable_upload.get_session(upload_id, principal.id)
+    return Response(headers=_offset_headers(session))
+
+
+@router.patch("/blob/resumable/{upload_id}", status_code=status.HTTP_204_NO_CONTENT,
+              openapi_extra={"requestBody": {"required": True, "content": {
+                  "application/offset+octet-stream": {"schema": {"type": "string", "format": "binary"}}
+              }}})
+async def append_resumable_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        upload_id: str,
+        request: Request,
+        upload_offset: Annotated[int, Header(description="Offset the chunk starts at, from HEAD")],
+):
+    """
+    Append a chunk (Content-Type: application/offset+octet-stream). The response's
+    Upload-Offset tells how much of it was stored.
+    """
+    if request.headers.get("Content-Type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Expected application/offset+octet-stream")
+
+    async with resumable_upload.locked_session(upload_id) as ensure_locked:
+        session = await resumable_upload.get_session(upload_id, principal.id)
+        if upload_offset != session["offset"]:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload-Offset does not match",
+                                headers=_offset_headers(session))
+
+        async def commit(part: dict, length: int):
+            await ensure_locked()
+            session["parts"].append(part)
+            session["offset"] += length
+            await resumable_upload.save_session(upload_id, session)
+
+        await append_parts_to_s3(request, session, commit)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_offset_headers(session))
+
+
+@router.post("/blob/resumable/{upload_id}/complete", response_model=base.BlobInfo)
+async def complete_resumable_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        upload_id: str,
+):
+    """
+    Assemble the uploaded parts and register the blob once the whole file was sent.
+    Calling this again after a failure finishes the upload, or returns the blob it registered.
+    """
+    async with resumable_upload.locked_session(upload_id) as ensure_locked:
+        session = await resumable_upload.get_session(upload_id, principal.id)
+        if session["offset"] != session["size"]:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is not finished yet",
+                                headers=_offset_headers(session))
+
+        if not session.get("assembled"):
+            await run_s3(complete_multipart_upload, session["key"], session["s3_upload_id"], session["parts"])
+            # the multipart upload is gone now, a retry only has to register the blob; its id is
+            # fixed here, so a retry can tell whether the blob was committed before a failure
+            session["assembled"] = True
+            session["blob_id"] = models.new_id()
+            await ensure_locked()
+            await resumable_upload.save_session(upload_id, session)
+
+        new_blob = _registered_blob(db, session)
+        if new_blob is None:
+            new_blob = blob_crud.create_user_blobs(db, principal.id, [dict(
+                id=session["blob_id"], filename=session["filename"], content_type=session["content_type"],
+                url=public_url(session["key"]), object_key=session["key"], size=session["size"],
+            )])[0]
+        await resumable_upload.delete_session(upload_id)
+
+    await schedule_blob_processing([new_blob.id])
 
     return base.BlobInfo.from_model(new_blob)
 
 
-@router.get('/blobs', response_model=List[base.BlobInfo])
+@router.delete("/blob/resumable/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_resumable_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        upload_id: str,
+):
+    """
+    Give up a resumable upload and drop the parts stored so far.
+    """
+    async with resumable_upload.locked_session(upload_id):
+        session = await resumable_upload.get_session(upload_id, principal.id)
+        if not session.get("assembled"):
+            await run_s3(abort_multipart_upload, session["key"], session["s3_upload_id"])
+        elif _registered_blob(db, session) is None:
+            await run_s3(delete_from_s3, session["key"])
+        # else: the blob was registered and owns the object; only the session is left
+        await resumable_upload.delete_session(upload_id)
+
+
+def _registered_blob(db: Session, session: dict) -> models.Blob | None:
+    # the blob a failed complete committed before it could drop the session, if any
+    if "blob_id" not in session:
+        return None
+    db.use_primary()
+    return blob_crud.get_blob(db, session["blob_id"])
+
+
+def _offset_headers(session: dict) -> dict:
+    return {
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["size"]),
+        "Cache-Control": "no-store",
+    }
+
+
+@router.post("/blob/uploads/{upload_id}/complete", response_model=base.BlobInfo)
+async def complete_presigned_upload(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        upload_id: str,
+):
+    """
+    Phase two: check the uploaded object with a HEAD request and register it as a blob.
+    """
+    pending = await pending_upload.get_upload(upload_id, principal.id)
+
+    head = await run_s3(head_from_s3, pending["key"])
+    if head is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Object has not been uploaded yet")
+
+    expected_size = pending["size"]
+    if (
+            head["ContentLength"] > pending["max_size"]
+            or (expected_size is not None and head["ContentLength"] != expected_size)
+            or head.get("ContentType") != pending["content_type"]
+    ):
+        await pending_upload.claim_upload(upload_id)
+        await run_s3(delete_from_s3, pending["key"])
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded object does not match the upload")
+
+    await pending_upload.claim_upload(upload_id)
+    new_blob = blob_crud.create_user_blob(
+        db, principal.id, pending["filename"], pending["content_type"], public_url(pending["key"]),
+        object_key=pending["key"], size=head["ContentLength"],
+    )
+    await schedule_blob_processing([new_blob.id])
+
+    return base.BlobInfo.from_model(new_blob)
+
+
+@router.get("/blob/{blob_id}", response_class=Response, responses={
+    200: {"content": {"application/octet-stream": {}}, "description": "The file"},
+    206: {"description": "The requested byte range"},
+    304: {"description": "Not modified"},
+    416: {"description": "Range not satisfiable"},
+})
+async def download_blob(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        blob_id: str,
+        request: Request,
+):
+    """
+    Download one of your blobs. Supports Range, If-Range, If-None-Match and If-Modified-Since.
+    """
+    blob = blob_crud.get_user_blob(db, principal.id, blob_id)
+    if blob.status == "pending":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Blob is still being stored",
+                            headers={"Retry-After": "1"})
+    if blob.status == "failed":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blob could not be stored")
+    object_key = blob.object_key or key_from_public_url(blob.url)
+    if object_key is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blob content is not stored here")
+
+    # a blob's content never changes: the digest, else its id, is a strong validator
+    size, etag = blob.size, f'"{blob.digest or blob.id}"'
+    if size is None:
+        head = await run_s3(head_from_s3, object_key)
+        if head is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blob content is missing")
+        size = head["ContentLength"]
+
+    # only content whose digest was checked on upload is cached; presigned objects carry none
+    digest = blob.digest if (blob.status or "ready") == "ready" else None
+    return await object_response(request, object_key, blob.filename, blob.content_type, size, etag,
+                                 blob.created_at, digest)
+
+
+@router.get("/blob/{blob_id}/status", response_model=base.BlobStatus)
+async def get_blob_status(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        blob_id: str,
+):
+    """
+    Progress of a blob uploaded with Prefer: respond-async: pending while it is on its way
+    to storage, then ready (or failed).
+    """
+    blob = blob_crud.get_user_blob(db, principal.id, blob_id)
+    blob_status = blob.status or "ready"
+    if blob_status == "pending":
+        uploaded_bytes = await get_progress(blob.id) or 0
+    else:
+        uploaded_bytes = blob.size if blob_status == "ready" else None
+    return base.BlobStatus(id=blob.id, status=blob_status, size=blob.size, uploaded_bytes=uploaded_bytes)
+
+
+@router.delete("/blob/{blob_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_blob(
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        blob_id: str,
+):
+    """
+    Delete one of your blobs. Its stored object is removed once no other blob shares it.
+    """
+    orphaned_key = blob_crud.delete_user_blob(db, principal.id, blob_id)
+    if orphaned_key is not None:
+        try:
+            await run_s3(delete_from_s3, orphaned_key)
+        except Exception as e:
+            # the blob is gone either way; the object is only left behind
+            logger.error(f"Failed to delete orphaned object {orphaned_key}: {e}")
+
+
+@router.get('/blobs', response_model=base.BlobPage)
+@cache_response()
 async def get_user_blobs(
-        user: Annotated[models.User, Depends(get_current_user)]
+        principal: Annotated[Principal, Depends(get_current_principal)],
+        db: Annotated[Session, Depends(get_db)],
+        limit: Annotated[int, Query(ge=1, le=BLOB_PAGE_MAX_SIZE)] = BLOB_PAGE_SIZE,
+        cursor: Annotated[str | None, Query(description="next_cursor from the previous page")] = None,
 ):
-    return [base.BlobInfo.from_model(blob) for blob in user.blobs]
+    blobs, next_cursor = blob_crud.get_user_blobs_page(db, principal.id, limit, cursor)
+    return base.BlobPage(items=[base.BlobInfo.from_model(blob) for blob in blobs], next_cursor=next_cursor)
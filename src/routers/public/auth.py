@@ -2,12 +2,11 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.dependencies.auth import authenticate_user
-from src.dependencies.basic import get_db
+from src.dependencies.auth import authenticate_user_async, issue_access_token
+from src.dependencies.basic import get_async_db
 from src.schemas.basic import Token
-from src.utils.credentials import create_access_token
 
 router = APIRouter()
 
@@ -15,9 +14,9 @@ router = APIRouter()
 @router.post("/login")
 async def login(
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
-    token = create_access_token({"sub": user.account[0].username})
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
+    token = issue_access_token(user)
 
     return Token(access_token=token, token_type="bearer")
@@ -1,7 +1,21 @@
 import logging
-from fastapi import APIRouter
+from typing import Annotated
+from fastapi import APIRouter, Query
+from fastapi.responses import PlainTextResponse
 import sentry_sdk
 
+from src.crud import principal_cache
+from src.crud.token_version import revoke_tokens
+from src.database.database import replicas
+from src.database.redis import redis_stats
+from src.database.telemetry import pool_stats
+from src.jobs.queue import job_queue
+from src.utils.blob_cache import blob_cache
+from src.utils.credentials import hashing_pool, token_cache
+from src.utils import response_cache
+from src.utils.metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
+from src.utils.s3 import s3_pool
+from src.utils.spool import upload_spool
 from src.utils.utils import wrap_logger
 
 router = APIRouter()
@@ -46,3 +60,107 @@ async def test_sentry_capture():
         "status": "success", 
         "message": "Manual message sent to Sentry"
     }
+
+
+@router.get("/stats/hashing-pool")
+async def hashing_pool_stats():
+    """
+    Queue depth, rejections and latency of the password hashing executor.
+    """
+    return hashing_pool.stats()
+
+
+@router.get("/stats/s3-pool")
+async def s3_pool_stats():
+    """
+    Queue depth, rejections and latency of the executor running S3 calls.
+    """
+    return s3_pool.stats()
+
+
+@router.get("/stats/blob-cache")
+async def blob_cache_stats():
+    """
+    Size, hit and eviction counters of the local disk cache of downloaded blobs.
+    """
+    return blob_cache.stats()
+
+
+@router.get("/stats/upload-spool")
+async def upload_spool_stats():
+    """
+    Bytes waiting, pending uploads and retry counters of the local upload spool.
+    """
+    return upload_spool.stats()
+
+
+@router.get("/stats/principal-cache")
+async def principal_cache_stats():
+    """
+    Hit, miss and eviction counters of the authenticated user cache.
+    """
+    return principal_cache.stats()
+
+
+@router.get("/stats/response-cache")
+async def response_cache_stats():
+    """
+    Hit, miss and invalidation counters of the cached GET responses.
+    """
+    return response_cache.stats()
+
+
+@router.get("/stats/token-cache")
+async def token_cache_stats():
+    """
+    Hit, miss and eviction counters of the verified access token cache.
+    """
+    return token_cache.stats()
+
+
+@router.get("/stats/db-pool")
+async def db_pool_stats():
+    """
+    Connection pool usage, checkout wait times and connection churn per engine.
+    """
+    return {"pools": pool_stats(), "replicas": replicas.stats()}
+
+
+@router.get("/stats/redis")
+async def redis_pool_stats():
+    """
+    Connection usage and checkout wait times of the shared Redis pools.
+    """
+    return redis_stats()
+
+
+@router.get("/stats/jobs")
+async def job_queue_stats(dead: Annotated[int, Query(ge=1, le=100)] = 10):
+    """
+    Ready, delayed, running and dead-lettered job counts, with the latest dead jobs.
+    """
+    return {**await job_queue.stats(), "dead_jobs": await job_queue.dead_jobs(dead)}
+
+
+@router.post("/jobs/dead/requeue")
+async def requeue_dead_jobs(limit: Annotated[int, Query(ge=1, le=1000)] = 100):
+    """
+    Run dead-lettered jobs again with fresh attempts, oldest first.
+    """
+    return {"requeued": await job_queue.requeue_dead(limit)}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    All collected metrics in Prometheus text format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.post("/users/{user_id}/revoke-tokens")
+async def revoke_user_tokens(user_id: str):
+    """
+    Invalidate every claims-mode access token issued to the user so far.
+    """
+    return {"user_id": user_id, "token_version": await revoke_tokens(user_id)}
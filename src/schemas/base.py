@@ -1,6 +1,9 @@
+from typing import Dict, List, Literal
+
 from pydantic import BaseModel, Field
 
 from src.database import models
+from src.schemas.basic import Principal
 
 
 class UserInfo(BaseModel):
@@ -12,13 +15,79 @@ class UserInfo(BaseModel):
     def from_model(user: models.User) -> "UserInfo":
         return UserInfo(id=user.id, name=user.name, username=user.account[0].username)
 
+    @staticmethod
+    def from_principal(principal: Principal) -> "UserInfo":
+        return UserInfo(id=principal.id, name=principal.name, username=principal.username)
+
+
+BlobState = Literal["pending", "ready", "failed"]
+
 
 class BlobInfo(BaseModel):
     id: str = Field(..., description="Blob ID")
     filename: str = Field(..., description="Blob Filename")
     content_type: str = Field(..., description="Blob Content Type")
     url: str = Field(..., description="Blob URL")
+    size: int | None = Field(default=None, description="Size in bytes, null for blobs uploaded before sizes were kept")
+    detected_type: str | None = Field(default=None, description="Content type sniffed from the bytes, null until processed")
+    file_metadata: dict | None = Field(default=None, description="SHA-256 and image width/height, null until processed")
+    status: BlobState = Field(default="ready", description="pending until an upload acknowledged early is stored")
     
     @staticmethod
     def from_model(blob: models.Blob) -> "BlobInfo":
-        return BlobInfo(id=blob.id, filename=blob.filename, content_type=blob.content_type, url=blob.url)
\ No newline at end of file
+        return BlobInfo(id=blob.id, filename=blob.filename, content_type=blob.content_type, url=blob.url, size=blob.size,
+                        detected_type=blob.detected_type, file_metadata=blob.file_metadata,
+                        status=blob.status or "ready")
+
+
+class BlobStatus(BaseModel):
+    id: str = Field(..., description="Blob ID")
+    status: BlobState = Field(..., description="pending: received, still on its way to storage")
+    size: int | None = Field(default=None, description="Size in bytes")
+    uploaded_bytes: int | None = Field(default=None, description="Bytes in storage so far, null if the upload failed")
+
+
+class BlobPage(BaseModel):
+    items: List[BlobInfo] = Field(..., description="Blobs on this page, newest first")
+    next_cursor: str | None = Field(default=None, description="Cursor for the next page, null on the last page")
+
+
+class BlobUploadResult(BaseModel):
+    filename: str = Field(..., description="Original filename")
+    size: int = Field(..., description="Bytes received")
+    blob: BlobInfo | None = Field(default=None, description="The stored blob, null if the upload failed")
+    error: str | None = Field(default=None, description="Why the upload failed")
+
+
+class BlobUploadResults(BaseModel):
+    items: List[BlobUploadResult] = Field(..., description="One result per file, in request order")
+
+
+class ResumableUploadRequest(BaseModel):
+    filename: str = Field(..., max_length=512, description="Original filename")
+    content_type: str = Field(..., max_length=16, description="Content type of the file")
+    size: int = Field(..., gt=0, description="Total size in bytes")
+
+
+class ResumableUpload(BaseModel):
+    upload_id: str = Field(..., description="Id of the upload session")
+    offset: int = Field(..., description="Bytes stored so far; the next chunk starts here")
+    size: int = Field(..., description="Total size in bytes")
+    part_size: int = Field(..., description="Send chunks in multiples of this, only whole parts are kept")
+    expires_in: int = Field(..., description="Seconds an idle session is kept")
+
+
+class PresignedUploadRequest(BaseModel):
+    filename: str = Field(..., max_length=512, description="Original filename")
+    content_type: str = Field(..., max_length=16, description="Content type the client will upload with")
+    size: int | None = Field(default=None, gt=0, description="Exact size in bytes, required for PUT")
+    method: Literal["post", "put"] = Field(default="post", description="Browser form POST or plain PUT")
+
+
+class PresignedUpload(BaseModel):
+    upload_id: str = Field(..., description="Pass to the completion endpoint once the upload finished")
+    method: Literal["post", "put"] = Field(..., description="HTTP method to upload with")
+    url: str = Field(..., description="Presigned bucket URL")
+    fields: Dict[str, str] = Field(default_factory=dict, description="POST form fields, send before the file")
+    headers: Dict[str, str] = Field(default_factory=dict, description="Headers the PUT request must send")
+    expires_in: int = Field(..., description="Seconds until the URL expires")
@@ -11,7 +11,23 @@ class Token(BaseModel):
 
 
 class UploadedFile(BaseModel):
-    path: str = Field(..., title="Local Path")
     original_file_name: str = Field(..., title="Original File Name")
     extension: str = Field(..., title="File Extension")
     content_type: str = Field(..., title="Content Type")
+    key: str = Field(..., title="S3 Object Key")
+    url: str = Field(..., title="Public URL")
+    size: int = Field(..., title="Size in Bytes")
+    digest: str | None = Field(default=None, title="SHA-256 Hex Digest")
+    deduplicated: bool = Field(default=False, title="Reuses an Already Stored Object")
+    error: str | None = Field(default=None, title="Upload Error")
+
+
+class Principal(BaseModel):
+    id: str = Field(..., title="User ID")
+    name: str = Field(..., title="User Name")
+    username: str = Field(..., title="User Account Username")
+    token_version: int | None = Field(default=None, title="Token Version")
+
+    @staticmethod
+    def from_model(user) -> "Principal":
+        return Principal(id=user.id, name=user.name, username=user.account[0].username)
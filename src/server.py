@@ -1,7 +1,9 @@
+import math
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from starlette.requests import Request
 import sentry_sdk
 from sentry_sdk.integrations.fastapi import FastApiIntegration
@@ -12,8 +14,17 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sentry_sdk.integrations.threading import ThreadingIntegration
 import logging
 
+from src.database.database import replicas
+from src.database.profiling import QueryBudgetMiddleware
+from src.database.redis import close_redis, init_redis
+from src.jobs.tasks import finish_spooled_upload, spooled_upload_pending
 from src.routers.server import router
 from src.schemas.basic import TextOnly
+from src.utils.blob_cache import blob_cache
+from src.utils.credentials import hashing_pool
+from src.utils.executor import ExecutorSaturated
+from src.utils.s3 import s3_pool
+from src.utils.spool import upload_spool
 from src.utils.swagger import custom_swagger_ui_html
 
 # Initialize Sentry
@@ -59,6 +70,23 @@ if sentry_dsn:
         before_send=lambda event, hint: event,  # Hook to modify events before sending
     )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # shared per-worker resources: created once at startup, released on shutdown
+    await init_redis()
+    replicas.start()
+    blob_cache.open()
+    upload_spool.open(finish_spooled_upload, spooled_upload_pending)
+    yield
+    await upload_spool.close()
+    await blob_cache.close()
+    await close_redis()
+    replicas.stop()
+    hashing_pool.shutdown()
+    s3_pool.shutdown()
+
+
 app = FastAPI(
     title="Template FastAPI Backend Server",
     description="Template Description",
@@ -67,9 +95,12 @@ app = FastAPI(
         "name": "Author Name",
         "email": "example@exmaple.com",
     },
-    docs_url=None
+    docs_url=None,
+    lifespan=lifespan
 )
 
+app.add_middleware(QueryBudgetMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -81,6 +112,15 @@ app.add_middleware(
 app.include_router(router)
 
 
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 @app.get("/docs", include_in_schema=False)
 async def custom_docs():
     return custom_swagger_ui_html(
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from src.utils.metrics import PrometheusWriter, register_collector
+from src.utils.s3 import download_from_s3, run_s3
+from src.utils.utils import wrap_logger
+from src.utils.worker_dirs import create_worker_directory, dead_worker_directories
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# Local copies of hot S3 objects for downloads; empty disables the cache
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "/tmp/blob-cache")
+# per worker process
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+BLOB_CACHE_MAX_OBJECT_SIZE = int(os.getenv("BLOB_CACHE_MAX_OBJECT_SIZE", str(64 * 1024 * 1024)))
+# an object is copied in on its n-th download, so one-off downloads don't evict hot objects
+BLOB_CACHE_ADMIT_AFTER = int(os.getenv("BLOB_CACHE_ADMIT_AFTER", "2"))
+
+# how many not yet cached objects are remembered for admission
+_MAX_CANDIDATES = 10000
+
+
+class DiskLRU:
+    """
+    Size-bounded LRU of S3 objects on local disk, one directory per worker process. Directories
+    left by dead workers are removed at startup.
+
+    Entries are keyed by the SHA-256 digest of their content, not by object key: the object
+    behind a key can be overwritten (presigned uploads), a digest always names the same bytes.
+    A copy that doesn't hash to its digest is dropped. Entries only leave the cache when it is
+    over `max_bytes`. Objects are copied in by a background task, misses are served from S3
+    meanwhile.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_object_size: int, admit_after: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.admit_after = admit_after
+        self.directory: str | None = None
+
+        self._lock_file = None
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._candidates: OrderedDict[str, int] = OrderedDict()
+        self._filling: dict[str, asyncio.Task] = {}
+        self._links = itertools.count()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.fill_failures = 0
+        self.evictions = 0
+
+    def open(self):
+        # called in the worker process, after the fork
+        if not self.root:
+            return
+        self.directory, self._lock_file = create_worker_directory(self.root)
+        # caches of crashed or restarted workers count against no budget, drop them
+        for _ in dead_worker_directories(self.root, self.directory):
+            pass
+
+    async def close(self):
+        for task in list(self._filling.values()):
+            task.cancel()
+        await asyncio.gather(*self._filling.values(), return_exceptions=True)
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.directory = None
+        self._entries.clear()
+        self.bytes = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def get(self, digest: str) -> str | None:
+        """
+        Path of a hardlink to the cached object, or None if it isn't cached. The link belongs
+        to the caller alone, so evicting the entry meanwhile doesn't pull the file from under
+        a response still sending it; the caller hands it back with release().
+        """
+        if self.directory is None:
+            return None
+        if digest not in self._entries:
+            self.misses += 1
+            return None
+        link = f"{self.path(digest)}.{next(self._links)}.send"
+        try:
+            os.link(self.path(digest), link)
+        except FileNotFoundError:
+            # removed behind the cache's back
+            self.bytes -= self._entries.pop(digest)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return link
+
+    @staticmethod
+    def release(link: str):
+        try:
+            os.unlink(link)
+        except FileNotFoundError:
+            pass
+
+    def admit(self, digest: str, key: str, size: int):
+        """
+        Count a download of an uncached object and copy the object at `key` in once it is hot.
+        """
+        if self.directory is None or size > self.max_object_size or digest in self._filling:
+            return
+        requests = self._candidates.pop(digest, 0) + 1
+        if requests < self.admit_after:
+            self._candidates[digest] = requests
+            while len(self._candidates) > _MAX_CANDIDATES:
+                self._candidates.popitem(last=False)
+            return
+        self._filling[digest] = asyncio.create_task(self._fill(digest, key))
+
+    async def _fill(self, digest: str, key: str):
+        path = self.path(digest)
+        partial = path + ".part"
+        try:
+            await run_s3(download_from_s3, key, partial)
+            if await asyncio.to_thread(_file_digest, partial) != digest:
+                raise ValueError(f"content doesn't match digest {digest}")
+            os.replace(partial, path)
+            size = os.path.getsize(path)
+            self._entries[digest] = size
+            self.bytes += size
+            self.fills += 1
+            self._evict()
+        except Exception as e:
+            self.fill_failures += 1
+            logger.warning(f"Caching {key} on disk failed: {e}")
+            try:
+                os.unlink(partial)
+            except OSError:
+                pass
+        finally:
+            del self._filling[digest]
+
+    def _evict(self):
+        # responses still sending an entry hold their own hardlink to it, see get()
+        while self.bytes > self.max_bytes and self._entries:
+            digest, size = self._entries.popitem(last=False)
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                pass
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.directory is not None,
+            "directory": self.directory,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "filling": len(self._filling),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fills": self.fills,
+            "fill_failures": self.fill_failures,
+            "evictions": self.evictions,
+        }
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+blob_cache = DiskLRU(BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES, BLOB_CACHE_MAX_OBJECT_SIZE, BLOB_CACHE_ADMIT_AFTER)
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    writer.gauge("blob_cache_bytes", blob_cache.bytes, "Bytes of S3 objects cached on local disk")
+    writer.gauge("blob_cache_entries", len(blob_cache._entries), "S3 objects cached on local disk")
+    for key in ("hits", "misses", "fills", "fill_failures", "evictions"):
+        writer.counter(f"blob_cache_{key}_total", getattr(blob_cache, key), f"Blob disk cache {key.replace('_', ' ')}")
@@ -1,17 +1,37 @@
+import hashlib
+import os
+import time
 from datetime import datetime, timedelta, timezone
 
 from jose import jwt
 # from passlib.context import CryptContext
 from pwdlib import PasswordHash
 
+from src.utils.cache import TTLCache, write_cache_metrics
+from src.utils.executor import executor_from_env
 from src.utils.handler import handle_jwt_error
+from src.utils.metrics import PrometheusWriter, register_collector
 
 pwd_context = PasswordHash.recommended() #CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Argon2 is CPU and memory bound; keep it off the event loop and bounded so a login burst
+# cannot starve other requests on the same worker
+hashing_pool = executor_from_env("password-hashing", "PASSWORD_HASH", default_workers=min(4, os.cpu_count() or 1))
+
 SECRET_KEY = "c1b3e4b3-4b3c-4b3e-8b3c-4b3e4b3c4b3e"
 ALGORITHM = "HS256"
 EXPIRE_IN_MIN = 30
 
+# Verified payloads keyed by token digest; entries never outlive the token's own exp
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL", "3600"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_MAX_TTL)
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    write_cache_metrics(writer, "token", token_cache)
+
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -21,6 +41,14 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def hash_password_async(password: str) -> str:
+    return await hashing_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, period=timedelta(minutes=EXPIRE_IN_MIN)) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + period
@@ -32,4 +60,10 @@ def create_access_token(data: dict, period=timedelta(minutes=EXPIRE_IN_MIN)) ->
 
 @handle_jwt_error
 def decode_token(token: str) -> dict:
-    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if isinstance(payload.get("exp"), (int, float)):
+            token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    return dict(payload)
@@ -0,0 +1,147 @@
+import os
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+
+from src.utils.blob_cache import blob_cache
+from src.utils.s3 import content_disposition, get_from_s3, presigned_get, run_s3
+
+# stream: proxy objects through the worker; accel: let NGINX fetch them (X-Accel-Redirect, see NGINX.md)
+BLOB_DOWNLOAD_MODE = os.getenv("BLOB_DOWNLOAD_MODE", "stream").lower()
+# internal NGINX location that proxies to the presigned URL appended to it
+BLOB_ACCEL_PREFIX = os.getenv("BLOB_ACCEL_PREFIX", "/_blob_proxy/")
+BLOB_ACCEL_URL_EXPIRES = int(os.getenv("BLOB_ACCEL_URL_EXPIRES", "60"))
+# bytes read from S3 and held per streamed download at a time
+BLOB_DOWNLOAD_CHUNK_SIZE = int(os.getenv("BLOB_DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # weak comparison, as for If-None-Match
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def _parse_date(value: str) -> datetime | None:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+
+def not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = _parse_date(request.headers.get("if-modified-since", ""))
+    return if_modified_since is not None and last_modified.replace(microsecond=0) <= if_modified_since
+
+
+def parse_range(request: Request, size: int, etag: str, last_modified: datetime) -> tuple[int, int] | None:
+    """
+    The single byte range (start, end inclusive) to serve, or None for the whole object.
+    Multiple ranges, malformed headers and a stale If-Range fall back to the whole object.
+    """
+    header = request.headers.get("range")
+    if header is None:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None:
+        if if_range.startswith(("\"", "W/")):
+            if if_range != etag:
+                return None
+        elif _parse_date(if_range) != last_modified.replace(microsecond=0):
+            return None
+
+    match = _RANGE.match(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # suffix range: the last n bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _stream_body(body):
+    try:
+        while chunk := await run_s3(body.read, BLOB_DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        body.close()
+
+
+class _CachedFileResponse(FileResponse):
+    # sends a hardlink made by blob_cache.get() for this response, and removes it afterwards
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            blob_cache.release(self.path)
+
+
+async def object_response(
+        request: Request,
+        key: str,
+        filename: str,
+        content_type: str,
+        size: int,
+        etag: str,
+        last_modified: datetime,
+        digest: str | None = None,
+) -> Response:
+    """
+    Serve an S3 object with Range and conditional request support: through NGINX in accel
+    mode, from the local disk cache if it is hot there, else streamed from S3 in
+    BLOB_DOWNLOAD_CHUNK_SIZE chunks. Only objects with a `digest` (SHA-256 of their final
+    content) are cached.
+    """
+    last_modified = last_modified.replace(tzinfo=timezone.utc) if last_modified.tzinfo is None else last_modified
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": content_disposition(filename),
+    }
+
+    if_match = request.headers.get("if-match")
+    if if_match is not None and not _etag_matches(if_match, etag):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if BLOB_DOWNLOAD_MODE == "accel":
+        # NGINX fetches the presigned URL itself and handles Range against S3
+        url = presigned_get(key, content_type, filename, BLOB_ACCEL_URL_EXPIRES)
+        return Response(headers={**headers, "X-Accel-Redirect": BLOB_ACCEL_PREFIX + url.replace("://", "/", 1)})
+
+    byte_range = parse_range(request, size, etag, last_modified)
+    path = blob_cache.get(digest) if digest is not None else None
+    if path is not None:
+        # sendfile, or pathsend where the server supports it; FileResponse handles Range itself
+        return _CachedFileResponse(path, media_type=content_type, headers=headers)
+    if digest is not None:
+        blob_cache.admit(digest, key, size)
+    # request the object before answering, so S3 errors still turn into an error status
+    stream = _stream_body(await run_s3(get_from_s3, key, byte_range))
+
+    headers["Accept-Ranges"] = "bytes"
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(stream, media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(stream, status_code=status.HTTP_206_PARTIAL_CONTENT,
+                             media_type=content_type, headers=headers)
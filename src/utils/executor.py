@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.utils.metrics import Histogram, PrometheusWriter, register_collector
+
+# every executor created in this process, exported by the collector below
+executors: list["BoundedExecutor"] = []
+
+
+class ExecutorSaturated(Exception):
+    """
+    An executor had no room for more work; try again after `retry_after` seconds.
+    Routes answer it with 503 (see src/server.py), the job worker postpones the job.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    A size-limited executor for blocking work called from async code.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more may wait
+    for a slot, each for no longer than `queue_timeout` seconds. Anything beyond
+    that raises ExecutorSaturated instead of piling up behind the event loop.
+
+    Cancelling run() (a client disconnect, a job timeout) does not stop a function
+    that already started: threads and worker processes can't be interrupted. It runs
+    to the end and keeps its slot until then, so stuck calls show up as a saturated
+    executor rather than as more threads than `max_workers`.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_workers: int,
+            max_queue: int,
+            queue_timeout: float,
+            kind: str = "thread",
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._executor: Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+        self.run_seconds_max = 0.0
+        self.wait_seconds = Histogram()
+        self.run_seconds = Histogram()
+        executors.append(self)
+
+    def _get_executor(self) -> Executor:
+        # Created lazily so that process pools are forked inside the server worker
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=self.name
+                    )
+            return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        return self._slots
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        slots = self._get_slots()
+        enqueued_at = time.perf_counter()
+        if slots.locked():
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(f"{self.name} is saturated, try again later")
+
+            self.queued += 1
+            try:
+                await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise ExecutorSaturated(f"{self.name} queue wait exceeded {self.queue_timeout}s")
+            finally:
+                self.queued -= 1
+        else:
+            await slots.acquire()
+        self.started += 1
+
+        waited = time.perf_counter() - enqueued_at
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.wait_seconds.observe(waited)
+
+        self.running += 1
+        started_at = time.perf_counter()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        except BaseException:
+            self._finished(started_at, failed=True)
+            raise
+        # the slot is released when the function returns, not when the caller stops waiting
+        future.add_done_callback(lambda done: self._finished(
+            started_at, failed=done.cancelled() or done.exception() is not None))
+        return await asyncio.shield(future)
+
+    def _finished(self, started_at: float, failed: bool):
+        elapsed = time.perf_counter() - started_at
+        self.run_seconds_total += elapsed
+        self.run_seconds_max = max(self.run_seconds_max, elapsed)
+        self.run_seconds.observe(elapsed)
+        self.running -= 1
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_avg": self.wait_seconds_total / self.started if self.started else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+            "run_seconds_avg": self.run_seconds_total / finished if finished else 0.0,
+            "run_seconds_max": self.run_seconds_max,
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def executor_from_env(name: str, prefix: str, default_workers: int, default_kind: str = "thread") -> BoundedExecutor:
+    return BoundedExecutor(
+        name=name,
+        kind=os.getenv(f"{prefix}_EXECUTOR", default_kind).lower(),
+        max_workers=int(os.getenv(f"{prefix}_WORKERS", str(default_workers))),
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", str(default_workers * 16))),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", "5")),
+    )
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    for pool in executors:
+        name = pool.name
+        writer.gauge("executor_max_workers", pool.max_workers, "Executor worker limit", executor=name)
+        writer.gauge("executor_queue_depth", pool.queued, "Jobs waiting for an executor slot", executor=name)
+        writer.gauge("executor_running", pool.running, "Jobs running on the executor", executor=name)
+        for key in ("started", "completed", "failed", "rejected", "timed_out"):
+            writer.counter(f"executor_{key}_total", getattr(pool, key), f"Executor jobs {key.replace('_', ' ')}",
+                           executor=name)
+        writer.histogram("executor_wait_seconds", pool.wait_seconds, "Time jobs waited for an executor slot",
+                         executor=name)
+        writer.histogram("executor_run_seconds", pool.run_seconds, "Time jobs ran on the executor", executor=name)
@@ -1,14 +1,26 @@
+import inspect
 from functools import wraps
 from typing import Any, Callable
 
 from fastapi import HTTPException, status
 from jose import JWTError
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 
 def handle_none_value(item_name='Item'):
     def decorator(func: Callable[..., Any]):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                result = await func(*args, **kwargs)
+                if result is None:
+                    raise HTTPException(status_code=404, detail=f"{item_name} Not found")
+                return result
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
@@ -34,6 +46,8 @@ def handle_error(func: Callable[..., Any]):
         # return func(*args, **kwargs)
         try:
             return func(*args, **kwargs)
+        except HTTPException:
+            raise
         except IntegrityError as e:
             db.rollback()
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
@@ -44,6 +58,29 @@ def handle_error(func: Callable[..., Any]):
     return wrapper
 
 
+def handle_async_error(func: Callable[..., Any]):
+    """
+    first argument should be the async database session
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        db = args[0]
+        assert isinstance(db, AsyncSession), "First argument should be the async database session"
+        try:
+            return await func(*args, **kwargs)
+        except HTTPException:
+            raise
+        except IntegrityError as e:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    return wrapper
+
+
 def handle_jwt_error(func: Callable):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -0,0 +1,100 @@
+import bisect
+import threading
+from typing import Callable, Iterable
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Cumulative fixed-bucket histogram, in the shape Prometheus expects.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        result = []
+        for bound, count in zip((*map(str, self.buckets), "+Inf"), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class PrometheusWriter:
+    """
+    Minimal text exposition format writer. Samples are grouped per metric name,
+    so collectors may write the same metric for several label sets in any order.
+    """
+
+    def __init__(self):
+        self.families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def _samples(self, name: str, kind: str, help_text: str) -> list[str]:
+        if name not in self.families:
+            self.families[name] = (kind, help_text, [])
+        return self.families[name][2]
+
+    def gauge(self, name: str, value: float, help_text: str, **labels):
+        self._samples(name, "gauge", help_text).append(f"{name}{_labels(labels)} {value}")
+
+    def counter(self, name: str, value: float, help_text: str, **labels):
+        self._samples(name, "counter", help_text).append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, histogram: Histogram, help_text: str, **labels):
+        samples = self._samples(name, "histogram", help_text)
+        for bound, count in histogram.cumulative():
+            samples.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+        samples.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        samples.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Components register a callback that writes their metrics; /root/metrics renders all of them
+collectors: list[Callable[[PrometheusWriter], None]] = []
+
+
+def register_collector(collector: Callable[[PrometheusWriter], None]):
+    collectors.append(collector)
+    return collector
+
+
+def render_prometheus() -> str:
+    writer = PrometheusWriter()
+    for collector in collectors:
+        collector(writer)
+    return writer.render()
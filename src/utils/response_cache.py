@@ -0,0 +1,310 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from functools import wraps
+from typing import Awaitable, Callable, Iterable
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from redis.client import NEVER_DECODE
+from redis.exceptions import RedisError
+
+from src.database.redis import get_async_redis, get_redis
+from src.utils.metrics import PrometheusWriter, register_collector
+from src.utils.single_flight import SingleFlight, acquire_lock, release_lock, should_refresh_early, wait_for
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# bodies at least this large are stored zlib compressed
+RESPONSE_CACHE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_CACHE_COMPRESS_MIN_SIZE", "512"))
+
+KEY_PREFIX = "rc:"
+TAG_PREFIX = "rc:tag:"
+LOCK_PREFIX = "rc:lock:"
+# bumped by every invalidation of a tag; a missing counter reads as 0
+GENERATION_PREFIX = "rc:gen:"
+# far longer than any response takes to compute, so a counter never expires under one
+GENERATION_TTL = 24 * 3600
+
+# Store an entry only if none of its tags was invalidated since its generations were read,
+# i.e. while the route was computing it from data that may be stale by now.
+# KEYS: entry, generation keys, tag keys; ARGV: value, ttl, expected generations
+_WRITE_SCRIPT = """
+local count = (#KEYS - 1) / 2
+for i = 1, count do
+    if (redis.call("get", KEYS[1 + i]) or "0") ~= ARGV[2 + i] then
+        return 0
+    end
+end
+redis.call("set", KEYS[1], ARGV[1], "EX", ARGV[2])
+for i = 1, count do
+    local tag = KEYS[1 + count + i]
+    redis.call("sadd", tag, KEYS[1])
+    -- a tag set lives as long as its longest-lived entry
+    redis.call("expire", tag, ARGV[2], "NX")
+    redis.call("expire", tag, ARGV[2], "GT")
+end
+return 1
+"""
+
+# header in front of every stored body: encoding, compute time (XFetch delta), expiry timestamp
+HEADER = struct.Struct("!cdd")
+RAW = b"r"
+ZLIB = b"z"
+
+counters = {
+    "hits": 0, "misses": 0, "bypassed": 0, "errors": 0, "invalidations": 0,
+    "early_refreshes": 0, "lock_waits": 0, "stale_writes": 0,
+}
+flights = SingleFlight("response-cache")
+
+
+def user_tag(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def encode_entry(body: bytes, delta: float, ttl: int) -> bytes:
+    if len(body) >= RESPONSE_CACHE_COMPRESS_MIN_SIZE:
+        return HEADER.pack(ZLIB, delta, time.time() + ttl) + zlib.compress(body)
+    return HEADER.pack(RAW, delta, time.time() + ttl) + body
+
+
+def decode_entry(value: bytes) -> tuple[bytes, float, float]:
+    encoding, delta, expires_at = HEADER.unpack_from(value)
+    body = value[HEADER.size:]
+    return zlib.decompress(body) if encoding == ZLIB else body, delta, expires_at
+
+
+def cache_key(route: str, user_id: str, request: Request) -> str:
+    params = sorted(request.query_params.multi_items())
+    digest = hashlib.sha256(json.dumps([route, params]).encode()).hexdigest()[:32]
+    return f"{KEY_PREFIX}{user_id}:{digest}"
+
+
+def _serialize(result) -> bytes:
+    if isinstance(result, BaseModel):
+        return result.model_dump_json().encode()
+    return json.dumps(jsonable_encoder(result), separators=(",", ":")).encode()
+
+
+def _find_user_id(values: Iterable) -> str | None:
+    # the authenticated Principal/User the route depends on
+    for value in values:
+        user_id = getattr(value, "id", None)
+        if isinstance(user_id, str) and hasattr(value, "name"):
+            return user_id
+    return None
+
+
+async def _read(key: str) -> bytes | None:
+    try:
+        return await get_async_redis().execute_command("GET", key, **{NEVER_DECODE: True})
+    except RedisError as e:
+        counters["errors"] += 1
+        logger.warning(f"Response cache read failed: {e}")
+        return None
+
+
+async def _generations(tags: list[str]) -> list[str] | None:
+    if not tags:
+        return []
+    try:
+        values = await get_async_redis().mget([GENERATION_PREFIX + tag for tag in tags])
+    except RedisError as e:
+        counters["errors"] += 1
+        logger.warning(f"Response cache read failed: {e}")
+        return None
+    return [value or "0" for value in values]
+
+
+async def _write(key: str, value: bytes, tags: list[str], ttl: int, generations: list[str] | None):
+    if generations is None:
+        return
+    try:
+        stored = await get_async_redis().eval(
+            _WRITE_SCRIPT, 1 + 2 * len(tags),
+            key, *[GENERATION_PREFIX + tag for tag in tags], *[TAG_PREFIX + tag for tag in tags],
+            value, ttl, *generations,
+        )
+    except RedisError as e:
+        counters["errors"] += 1
+        logger.warning(f"Response cache write failed: {e}")
+        return
+    if not stored:
+        # invalidated while the route ran: the body may predate the write, don't serve it for the TTL
+        counters["stale_writes"] += 1
+
+
+async def _load(key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+    """
+    Recompute a missing entry. Only the worker holding the key's lock runs the route;
+    the others wait for its result to show up in Redis.
+    """
+    redis = get_async_redis()
+    try:
+        token = await acquire_lock(redis, LOCK_PREFIX + key)
+    except RedisError:
+        return await compute()
+
+    if token is None:
+        counters["lock_waits"] += 1
+        cached = await wait_for(lambda: _read(key))
+        if cached is not None:
+            return decode_entry(cached)[0]
+        return await compute()
+
+    try:
+        return await compute()
+    finally:
+        try:
+            await release_lock(redis, LOCK_PREFIX + key, token)
+        except RedisError:
+            pass  # expires on its own
+
+
+async def _refresh(key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes | None:
+    # early refresh is best effort: if another worker holds the lock, keep serving the entry
+    redis = get_async_redis()
+    try:
+        token = await acquire_lock(redis, LOCK_PREFIX + key)
+    except RedisError:
+        return None
+    if token is None:
+        return None
+    try:
+        counters["early_refreshes"] += 1
+        return await compute()
+    finally:
+        try:
+            await release_lock(redis, LOCK_PREFIX + key, token)
+        except RedisError:
+            pass
+
+
+def cache_response(ttl: int = RESPONSE_CACHE_TTL, tags: Callable[[str], list[str]] = lambda user_id: [user_tag(user_id)]):
+    """
+    Cache the JSON body of an authenticated GET route in Redis, per route, user and query string.
+
+    The route must depend on the current Principal/User. Entries are dropped after `ttl`
+    seconds or when any of their tags is invalidated by a write path (see invalidate_tags).
+    Put it below the router decorator:
+
+        @router.get("/blobs", response_model=BlobPage)
+        @cache_response(ttl=30)
+        async def get_user_blobs(principal: ..., ...):
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        request_param = next(
+            (name for name, param in signature.parameters.items() if param.annotation is Request), None
+        )
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs[request_param] if request_param else kwargs.pop("_cache_request")
+            user_id = _find_user_id(kwargs.values())
+            if not RESPONSE_CACHE_ENABLED or user_id is None:
+                counters["bypassed"] += 1
+                return await func(*args, **kwargs)
+
+            key = cache_key(request.scope["route"].path, user_id, request)
+
+            async def compute() -> bytes:
+                entry_tags = tags(user_id)
+                # read before the route runs, so an invalidation during it discards the write
+                generations = await _generations(entry_tags)
+                started_at = time.perf_counter()
+                body = _serialize(await func(*args, **kwargs))
+                await _write(key, encode_entry(body, time.perf_counter() - started_at, ttl), entry_tags, ttl,
+                             generations)
+                return body
+
+            cached = await _read(key)
+            if cached is not None:
+                body, delta, expires_at = decode_entry(cached)
+                if should_refresh_early(delta, expires_at):
+                    refreshed = await flights.do("refresh:" + key, lambda: _refresh(key, compute))
+                    if refreshed is not None:
+                        return Response(refreshed, media_type="application/json", headers={"X-Cache": "REFRESH"})
+                counters["hits"] += 1
+                return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+            # concurrent misses in this worker share one load, other workers wait on the lock
+            counters["misses"] += 1
+            body = await flights.do(key, lambda: _load(key, compute))
+            return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+        if request_param is None:
+            # FastAPI injects the request through this extra, hidden parameter
+            wrapper.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter("_cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            ])
+        return wrapper
+
+    return decorator
+
+
+def invalidate_tags(*tags: str):
+    """
+    Drop every cached response carrying one of the tags. Called by write paths after commit.
+    """
+    if not tags:
+        return
+    try:
+        redis = get_redis()
+        # bumped first: an entry written before is in its tag set below, one written after is refused
+        with redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(GENERATION_PREFIX + tag)
+                pipe.expire(GENERATION_PREFIX + tag, GENERATION_TTL)
+            pipe.execute()
+        tag_keys = [TAG_PREFIX + tag for tag in tags]
+        keys = set().union(*(redis.smembers(tag_key) for tag_key in tag_keys))
+        redis.delete(*keys, *tag_keys)
+        counters["invalidations"] += len(keys)
+    except RedisError as e:
+        counters["errors"] += 1
+        logger.warning(f"Response cache invalidation failed: {e}")
+
+
+async def invalidate_tags_async(*tags: str):
+    if not tags:
+        return
+    try:
+        redis = get_async_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(GENERATION_PREFIX + tag)
+                pipe.expire(GENERATION_PREFIX + tag, GENERATION_TTL)
+            await pipe.execute()
+        tag_keys = [TAG_PREFIX + tag for tag in tags]
+        keys = set().union(*[await redis.smembers(tag_key) for tag_key in tag_keys])
+        await redis.delete(*keys, *tag_keys)
+        counters["invalidations"] += len(keys)
+    except RedisError as e:
+        counters["errors"] += 1
+        logger.warning(f"Response cache invalidation failed: {e}")
+
+
+def stats() -> dict:
+    return {"enabled": RESPONSE_CACHE_ENABLED, "ttl": RESPONSE_CACHE_TTL, **counters, "single_flight": flights.stats()}
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    for key, value in counters.items():
+        writer.counter(f"response_cache_{key}_total", value, f"Response cache {key.replace('_', ' ')}")
+    writer.counter("response_cache_coalesced_total", flights.followers,
+                   "Requests that awaited another request's in-flight load")
@@ -1,12 +1,15 @@
+import asyncio
+import hashlib
 import os
-from tempfile import NamedTemporaryFile
-from typing import List
+from functools import partial
+from urllib.parse import quote
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
-from fastapi import UploadFile
+from botocore.exceptions import ClientError
 
-from src.schemas.basic import UploadedFile
+from src.utils.executor import executor_from_env
 
 # Check if using MinIO or AWS S3
 IS_MINIO = os.getenv('S3_PROVIDER', 'aws').lower() == 'minio'
@@ -17,11 +20,49 @@ SECRET_KEY_NAME = "AWS_SECRET_ACCESS_KEY" if not IS_MINIO else "MINIO_ROOT_PASSW
 
 MINIO_DNS_URL = os.getenv('MINIO_DNS_URL')
 
+# Streaming uploads: S3 requires every part but the last to be at least 5 MiB, and allows S3_MAX_PARTS
+S3_MAX_PARTS = 10000
+S3_MULTIPART_PART_SIZE = max(int(os.getenv('S3_MULTIPART_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+# parts uploading concurrently per object; memory per upload is about part size * (this + 1)
+S3_MULTIPART_MAX_IN_FLIGHT = int(os.getenv('S3_MULTIPART_MAX_IN_FLIGHT', '2'))
+
+# boto3 calls block, so async code runs them here instead of on the event loop or
+# starlette's shared threadpool (S3_WORKERS, S3_MAX_QUEUE, S3_QUEUE_TIMEOUT)
+s3_pool = executor_from_env("s3", "S3", default_workers=16)
+
+# boto3 client tuning (see benchmarks/s3_transfer.py)
+# HTTP connections kept per client; each executor thread or transfer thread uses one at a time
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', str(max(s3_pool.max_workers, 10))))
+# standard | adaptive | legacy; adaptive also rate limits the client when S3 starts throttling
+S3_RETRY_MODE = os.getenv('S3_RETRY_MODE', 'adaptive')
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '5'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+S3_TCP_KEEPALIVE = os.getenv('S3_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+# Managed transfers (upload_local_to_s3): files above the threshold are sent as
+# multipart uploads of S3_MULTIPART_PART_SIZE chunks, this many parts at once
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', str(S3_MULTIPART_PART_SIZE)))
+S3_TRANSFER_MAX_CONCURRENCY = int(os.getenv('S3_TRANSFER_MAX_CONCURRENCY', '10'))
+
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_PART_SIZE,
+    max_concurrency=S3_TRANSFER_MAX_CONCURRENCY,
+)
+
 # Configure S3 client with support for both AWS S3 and MinIO
 s3_config = {
     'aws_access_key_id': os.getenv(ACCESS_KEY_NAME),
     'aws_secret_access_key': os.getenv(SECRET_KEY_NAME),
-    'config': Config(s3={"use_accelerate_endpoint": False})
+    'config': Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={'mode': S3_RETRY_MODE, 'max_attempts': S3_MAX_ATTEMPTS},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        tcp_keepalive=S3_TCP_KEEPALIVE,
+        s3={"use_accelerate_endpoint": False},
+    )
 }
 
 # Add endpoint URL for MinIO or custom S3-compatible services
@@ -34,6 +75,14 @@ if not IS_MINIO:
 
 s3 = boto3.client('s3', **s3_config)
 
+# Presigned URLs are used by clients, so they must be signed for the public endpoint
+# (e.g. MINIO_DNS_URL instead of the docker-internal S3_ENDPOINT_URL). Signing is local, no requests are made.
+presign_config = {**s3_config, 'config': Config(signature_version='s3v4', s3={"use_accelerate_endpoint": False})}
+if IS_MINIO and MINIO_DNS_URL:
+    presign_config['endpoint_url'] = MINIO_DNS_URL
+    presign_config.setdefault('region_name', 'us-east-1')
+presign_s3 = boto3.client('s3', **presign_config)
+
 
 def s3_url_to_cloudfront(url):
     # Only apply CloudFront transformation for AWS S3
@@ -43,7 +92,31 @@ def s3_url_to_cloudfront(url):
     return url.replace(s3_domain, os.getenv('AWS_CLOUDFRONT_DOMAIN'))
 
 
-def upload_local_to_s3(local_path, s3_path, content_type):
+def public_url(s3_path):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+
+    # Generate appropriate URL based on provider
+    if IS_MINIO and MINIO_DNS_URL:
+        # MinIO URL format
+        url = f"{MINIO_DNS_URL}/{bucket_name}/{s3_path}"
+    else:
+        # AWS S3 URL format
+        url = f"https://{bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{s3_path}"
+
+    return s3_url_to_cloudfront(url)
+
+
+def key_from_public_url(url):
+    """
+    Object key of a URL built by public_url, or None if it points elsewhere.
+    """
+    prefix = public_url("")
+    if not url.startswith(prefix) or url == prefix:
+        return None
+    return url[len(prefix):]
+
+
+def upload_local_to_s3(local_path, s3_path, content_type, callback=None):
     """
     Upload a local file to S3 or MinIO.
 
@@ -51,45 +124,253 @@ def upload_local_to_s3(local_path, s3_path, content_type):
         local_path: Path to the local file
         s3_path: Destination path in the S3/MinIO bucket
         content_type: MIME type of the file
+        callback: Optional, called with the number of bytes sent after each chunk (from transfer threads)
 
     Returns:
         Public URL of the uploaded file (CloudFront URL for AWS, direct URL for MinIO)
     """
     bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
-    s3.upload_file(local_path, bucket_name, s3_path, ExtraArgs={'ContentType': content_type})
+    s3.upload_file(local_path, bucket_name, s3_path, ExtraArgs={'ContentType': content_type}, Config=transfer_config,
+                   Callback=callback)
 
-    # Generate appropriate URL based on provider
-    if IS_MINIO and MINIO_DNS_URL:
-        # MinIO URL format
-        public_url = f"{MINIO_DNS_URL}/{bucket_name}/{s3_path}"
-    else:
-        # AWS S3 URL format
-        public_url = f"https://{bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{s3_path}"
+    return public_url(s3_path)
+
+
+async def run_s3(func, *args, **kwargs):
+    """
+    Run a blocking S3 call (a boto3 client method or one of the helpers here) on s3_pool.
+    """
+    return await s3_pool.run(partial(func, *args, **kwargs))
+
+
+def presigned_post(s3_path, content_type, max_size, expires_in):
+    """
+    Presigned POST policy for a browser form upload. S3 itself rejects bodies larger than
+    max_size or with a different Content-Type.
+
+    Returns:
+        {"url": ..., "fields": {...}}; the file must be the last form field
+    """
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    return presign_s3.generate_presigned_post(
+        bucket_name,
+        s3_path,
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+        ExpiresIn=expires_in,
+    )
 
-    return s3_url_to_cloudfront(public_url)
 
+def presigned_put(s3_path, content_type, size, expires_in):
+    """
+    Presigned PUT URL. Content-Type and Content-Length are signed, so the client must send
+    exactly these headers.
+    """
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    return presign_s3.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': bucket_name, 'Key': s3_path, 'ContentType': content_type, 'ContentLength': size},
+        ExpiresIn=expires_in,
+    )
 
-def save_upload_files_locally(files: List[UploadFile] | UploadFile) -> List[UploadedFile]:
-    if not isinstance(files, list):
-        files = [files]
 
-    entries = []
+def head_from_s3(s3_path):
+    """
+    Object metadata, or None if the object does not exist.
+    """
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    try:
+        return s3.head_object(Bucket=bucket_name, Key=s3_path)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
 
-    for file in files:
-        file_extension = file.filename.split(".")[-1]
 
-        with NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-            file_content = file.file.read()
-            temp_file.write(file_content)
-            temp_file.flush()
+def download_from_s3(s3_path, local_path):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    s3.download_file(bucket_name, s3_path, local_path, Config=transfer_config)
 
-        entries.append(
-            UploadedFile(
-                path=temp_file.name,
-                original_file_name=file.filename,
-                extension=file_extension,
-                content_type=file.content_type
+
+def get_from_s3(s3_path, byte_range=None):
+    """
+    Streaming body of an object, optionally only `byte_range` (start, end), both inclusive.
+    Read it in chunks and close it when done.
+    """
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    params = {'Bucket': bucket_name, 'Key': s3_path}
+    if byte_range is not None:
+        params['Range'] = f"bytes={byte_range[0]}-{byte_range[1]}"
+    return s3.get_object(**params)['Body']
+
+
+def presigned_get(s3_path, content_type, filename, expires_in):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    return presign_s3.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': bucket_name,
+            'Key': s3_path,
+            'ResponseContentType': content_type,
+            'ResponseContentDisposition': content_disposition(filename),
+        },
+        ExpiresIn=expires_in,
+    )
+
+
+def content_disposition(filename, disposition="attachment"):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+def delete_from_s3(s3_path):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    s3.delete_object(Bucket=bucket_name, Key=s3_path)
+
+
+# Multipart uploads that outlive a request (resumable uploads); S3MultipartWriter covers a single request
+
+def create_multipart_upload(s3_path, content_type):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    return s3.create_multipart_upload(Bucket=bucket_name, Key=s3_path, ContentType=content_type)["UploadId"]
+
+
+def upload_part(s3_path, upload_id, part_number, body):
+    """
+    Returns the part's entry for complete_multipart_upload.
+    """
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    response = s3.upload_part(Bucket=bucket_name, Key=s3_path, UploadId=upload_id, PartNumber=part_number, Body=body)
+    return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+
+def complete_multipart_upload(s3_path, upload_id, parts):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    s3.complete_multipart_upload(
+        Bucket=bucket_name, Key=s3_path, UploadId=upload_id,
+        MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])},
+    )
+
+
+def abort_multipart_upload(s3_path, upload_id):
+    bucket_name = str(os.environ.get('AWS_S3_BUCKET'))
+    s3.abort_multipart_upload(Bucket=bucket_name, Key=s3_path, UploadId=upload_id)
+
+
+class S3MultipartWriter:
+    """
+    Streams an object to S3 while it is being received, without buffering it whole.
+
+    Data is cut into S3_MULTIPART_PART_SIZE parts. At most `max_in_flight` parts upload at
+    once; write() waits for one of them before accepting more, which in turn stops reading
+    the request body. Objects smaller than one part are sent with a single PutObject, so
+    nothing reaches S3 before close() for them. `digest` is the SHA-256 of everything written.
+    Use it as an async context manager so the multipart upload is aborted on failure.
+    """
+
+    def __init__(
+            self,
+            s3_path: str,
+            content_type: str,
+            part_size: int = S3_MULTIPART_PART_SIZE,
+            max_in_flight: int = S3_MULTIPART_MAX_IN_FLIGHT,
+    ):
+        self.bucket = str(os.environ.get('AWS_S3_BUCKET'))
+        self.key = s3_path
+        self.content_type = content_type
+        self.part_size = part_size
+        self.max_in_flight = max_in_flight
+        self.size = 0
+
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._next_part = 1
+        self._parts: list[dict] = []
+        self._in_flight: set[asyncio.Task] = set()
+
+    async def __aenter__(self) -> "S3MultipartWriter":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            await self.abort()
+
+    @property
+    def digest(self) -> str:
+        return self._sha256.hexdigest()
+
+    async def write(self, data: bytes):
+        self._sha256.update(data)
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            with memoryview(self._buffer) as view:
+                part = bytes(view[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._submit(part)
+
+    async def close(self) -> int:
+        """
+        Upload what is left and complete the object. Returns its size in bytes.
+        """
+        if self._upload_id is None:
+            await run_s3(
+                s3.put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), ContentType=self.content_type
+            )
+        else:
+            if self._buffer:
+                await self._submit(bytes(self._buffer))
+            await self._wait(0)
+            await run_s3(
+                s3.complete_multipart_upload,
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": sorted(self._parts, key=lambda part: part["PartNumber"])},
             )
+        self._buffer.clear()
+        return self.size
+
+    async def delete(self):
+        """
+        Remove the object again after close().
+        """
+        await run_s3(delete_from_s3, self.key)
+
+    async def abort(self):
+        # let running part uploads finish first, so none of them lands after the abort
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._in_flight.clear()
+        self._buffer.clear()
+        if self._upload_id is not None:
+            await run_s3(
+                s3.abort_multipart_upload, Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+    async def _submit(self, body: bytes):
+        if self._upload_id is None:
+            response = await run_s3(
+                s3.create_multipart_upload, Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self._upload_id = response["UploadId"]
+        await self._wait(self.max_in_flight - 1)
+        task = asyncio.create_task(self._upload_part(self._next_part, body))
+        self._next_part += 1
+        self._in_flight.add(task)
+
+    async def _upload_part(self, number: int, body: bytes):
+        response = await run_s3(
+            s3.upload_part, Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=body
         )
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
 
-    return entries
+    async def _wait(self, max_pending: int):
+        # wait until at most max_pending parts are still uploading; re-raises part failures
+        while len(self._in_flight) > max_pending:
+            done, self._in_flight = await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
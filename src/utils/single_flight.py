@@ -0,0 +1,123 @@
+import asyncio
+import math
+import os
+import random
+import secrets
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from redis.asyncio import StrictRedis as AsyncRedis
+
+T = TypeVar("T")
+
+# How long a worker may hold the recompute lock of a key before others give up waiting
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "2"))
+CACHE_LOCK_POLL_INTERVAL = float(os.getenv("CACHE_LOCK_POLL_INTERVAL", "0.02"))
+# XFetch beta: > 1 refreshes earlier, < 1 later, 0 disables early refresh
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1"))
+
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+_EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent loads of the same key within one worker: the first caller runs
+    the loader, everyone arriving while it is in flight awaits the same result.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is not None:
+            self.followers += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the leader was cancelled, not us: load it ourselves
+                if future.cancelled():
+                    return await self.do(key, loader)
+                raise
+
+        self.leaders += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # followers re-raise it; don't warn when there are none
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {"name": self.name, "in_flight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+def should_refresh_early(delta: float, expires_at: float, beta: float = CACHE_EARLY_REFRESH_BETA) -> bool:
+    """
+    Probabilistic early expiration (XFetch): the closer an entry gets to expires_at and the
+    longer it took to compute (delta seconds), the likelier one reader recomputes it early,
+    so a hot key is refreshed by a single caller instead of expiring under all of them.
+    """
+    if beta <= 0:
+        return False
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+async def acquire_lock(redis: AsyncRedis, key: str, ttl: float = CACHE_LOCK_TTL) -> str | None:
+    """
+    Short cross-worker lock (SET NX PX). Returns the token needed to release it, or None if held.
+    """
+    token = secrets.token_hex(8)
+    if await redis.set(key, token, nx=True, px=int(ttl * 1000)):
+        return token
+    return None
+
+
+async def release_lock(redis: AsyncRedis, key: str, token: str):
+    # only delete the lock if it is still ours, it may have expired and been taken over
+    await redis.eval(_RELEASE_SCRIPT, 1, key, token)
+
+
+async def extend_lock(redis: AsyncRedis, key: str, token: str, ttl: float = CACHE_LOCK_TTL) -> bool:
+    """
+    Keep holding a lock for long running work. False if it expired and was taken over meanwhile.
+    """
+    return bool(await redis.eval(_EXTEND_SCRIPT, 1, key, token, int(ttl * 1000)))
+
+
+async def wait_for(read: Callable[[], Awaitable[T | None]], timeout: float = CACHE_LOCK_TTL) -> T | None:
+    """
+    Poll `read` until it returns a value or `timeout` passes, while another worker recomputes it.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        value = await read()
+        if value is not None:
+            return value
+    return None
@@ -0,0 +1,349 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+
+from src.database.redis import get_async_redis, get_redis
+from src.utils.metrics import PrometheusWriter, register_collector
+from src.utils.s3 import run_s3, upload_local_to_s3
+from src.utils.utils import wrap_logger
+from src.utils.worker_dirs import LOCK_FILE, create_worker_directory, dead_worker_directories
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# Uploads acknowledged before they reach S3 (Prefer: respond-async) wait here; empty disables it
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "/tmp/upload-spool")
+# per worker process; requests that don't fit are stored synchronously instead
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# spooled files uploading to S3 at once, per worker process
+UPLOAD_SPOOL_CONCURRENCY = int(os.getenv("UPLOAD_SPOOL_CONCURRENCY", "4"))
+# attempt n waits UPLOAD_SPOOL_RETRY_DELAY * 2^(n-1) seconds before the next one
+UPLOAD_SPOOL_MAX_ATTEMPTS = int(os.getenv("UPLOAD_SPOOL_MAX_ATTEMPTS", "5"))
+UPLOAD_SPOOL_RETRY_DELAY = float(os.getenv("UPLOAD_SPOOL_RETRY_DELAY", "2"))
+
+PROGRESS_PREFIX = "upload:spool:progress:"
+PROGRESS_TTL = 3600
+# seconds between progress writes to Redis for one upload
+_PROGRESS_INTERVAL = 0.5
+
+
+class SpoolWriter:
+    """
+    Receives a file into the spool. Same interface as S3MultipartWriter, so
+    stream_files_to_s3 can write to either. Hashing and disk writes run in a thread:
+    a slow or busy disk must not stall the event loop.
+    """
+
+    def __init__(self, spool: "UploadSpool", s3_path: str, content_type: str):
+        self.spool = spool
+        self.key = s3_path
+        self.content_type = content_type
+        self.name = uuid4().hex
+        self.path = os.path.join(spool.directory, self.name)
+        self.size = 0
+
+        self._sha256 = hashlib.sha256()
+        self._file = open(self.path, "xb")
+
+    @property
+    def digest(self) -> str:
+        return self._sha256.hexdigest()
+
+    async def write(self, data: bytes):
+        await asyncio.to_thread(self._write, data)
+        self.size += len(data)
+
+    def _write(self, data: bytes):
+        self._sha256.update(data)
+        self._file.write(data)
+
+    async def close(self) -> int:
+        await asyncio.to_thread(self._file.close)
+        self.spool.bytes += self.size
+        return self.size
+
+    async def abort(self):
+        await asyncio.to_thread(self._discard)
+
+    def _discard(self):
+        self._file.close()
+        _unlink(self.path)
+
+    async def delete(self):
+        await asyncio.to_thread(_unlink, self.path + ".json", self.path)
+        self.spool.bytes -= self.size
+
+
+class _Progress:
+    """
+    boto3 transfer callback that publishes the bytes sent so far to Redis, for status
+    requests served by any worker.
+    """
+
+    def __init__(self, blob_id: str):
+        self.key = PROGRESS_PREFIX + blob_id
+        self.sent = 0
+        self.published_at = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        with self._lock:
+            self.sent += bytes_amount
+            now = time.monotonic()
+            if now - self.published_at < _PROGRESS_INTERVAL:
+                return
+            self.published_at = now
+            sent = self.sent
+        try:
+            get_redis().set(self.key, sent, ex=PROGRESS_TTL)
+        except RedisError as e:
+            # progress is informational, never fail the transfer over it
+            logger.debug(f"Publishing upload progress failed: {e}")
+
+
+class UploadSpool:
+    """
+    Size-bounded local spool of received uploads, pushed to S3 in the background.
+
+    Each worker process owns a directory, locked with flock while the process lives (see
+    src.utils.worker_dirs). A received file gets a JSON sidecar naming its blob before the blob
+    is committed; on startup, the directories of dead workers are adopted and their files
+    uploaded again if their blob is still pending. Files without a sidecar, or whose blob was
+    never committed, belong to requests that failed and are dropped. The spool survives worker
+    restarts, not the loss of the disk.
+    """
+
+    def __init__(self, root: str, max_bytes: int, concurrency: int, max_attempts: int, retry_delay: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.directory: str | None = None
+
+        self._lock_file = None
+        self._on_uploaded: Callable[[dict, str | None], Awaitable[None]] | None = None
+        self._is_pending: Callable[[dict], Awaitable[bool]] | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._uploads: dict[str, asyncio.Task] = {}
+        # bytes of files on disk, and held for requests still being received
+        self.bytes = 0
+        self.reserved = 0
+
+        self.spooled = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.fallbacks = 0
+
+    def open(
+            self,
+            on_uploaded: Callable[[dict, str | None], Awaitable[None]],
+            is_pending: Callable[[dict], Awaitable[bool]],
+    ):
+        """
+        Called in the worker process at startup. `on_uploaded(entry, error)` runs after each
+        file reached S3 (error None) or gave up; the file is removed once it returned.
+        `is_pending(entry)` tells whether a file left by a previous process still has to be
+        uploaded, i.e. its blob was committed and is still pending.
+        """
+        if not self.root:
+            return
+        self._on_uploaded = on_uploaded
+        self._is_pending = is_pending
+        self.directory, self._lock_file = create_worker_directory(self.root)
+        self._adopt_orphans()
+        self._resume()
+
+    async def close(self):
+        # unfinished uploads stay on disk for the next start
+        for task in list(self._uploads.values()):
+            task.cancel()
+        await asyncio.gather(*self._uploads.values(), return_exceptions=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.directory = None
+
+    def reserve(self, size: int) -> bool:
+        """
+        Hold room for a request body of `size` bytes while it is received. False when the
+        spool is disabled or full; release() the reservation afterwards otherwise.
+        """
+        if self.directory is None:
+            return False
+        if self.bytes + self.reserved + size > self.max_bytes:
+            self.fallbacks += 1
+            return False
+        self.reserved += size
+        return True
+
+    def release(self, size: int):
+        self.reserved -= size
+
+    def writer(self, s3_path: str, content_type: str) -> SpoolWriter:
+        return SpoolWriter(self, s3_path, content_type)
+
+    async def record(self, writer: SpoolWriter, blob_id: str) -> dict:
+        """
+        Write the sidecar of a received file before its blob is committed, so the file is
+        found again if the process dies before submit(). writer.delete() removes it again.
+        """
+        entry = {
+            "blob_id": blob_id,
+            "name": writer.name,
+            "key": writer.key,
+            "content_type": writer.content_type,
+            "size": writer.size,
+        }
+        # fsync waits for the disk, in a thread
+        await asyncio.to_thread(self._write_sidecar, entry)
+        return entry
+
+    def _write_sidecar(self, entry: dict):
+        with open(self._sidecar(entry["name"]), "w") as file:
+            json.dump(entry, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def submit(self, entry: dict):
+        """
+        Upload a recorded file in the background, once its blob is committed.
+        """
+        self.spooled += 1
+        self._start(entry)
+
+    def _sidecar(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".json")
+
+    def _start(self, entry: dict, resumed: bool = False):
+        task = asyncio.create_task(self._upload(entry, resumed))
+        self._uploads[entry["blob_id"]] = task
+        task.add_done_callback(lambda _: self._uploads.pop(entry["blob_id"], None))
+
+    async def _upload(self, entry: dict, resumed: bool = False):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        path = os.path.join(self.directory, entry["name"])
+        if resumed:
+            try:
+                pending = await self._is_pending(entry)
+            except Exception as e:
+                # keep the file for the next start
+                logger.error(f"Checking spooled upload of blob {entry['blob_id']} failed: {e}")
+                return
+            if not pending:
+                # never committed, deleted meanwhile, or finished just before the restart
+                await self._remove(entry)
+                return
+
+        error = None
+        async with self._slots:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    await run_s3(upload_local_to_s3, path, entry["key"], entry["content_type"],
+                                 _Progress(entry["blob_id"]))
+                    error = None
+                    break
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    logger.warning(f"Uploading spooled {entry['key']} failed (attempt {attempt}): {error}")
+                    if attempt < self.max_attempts:
+                        self.retries += 1
+                        await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        try:
+            await self._on_uploaded(entry, error)
+        except Exception as e:
+            # keep the file; it is uploaded and reported again on the next start
+            logger.error(f"Finishing spooled upload of blob {entry['blob_id']} failed: {e}")
+            return
+        if error is None:
+            self.uploaded += 1
+        else:
+            self.failed += 1
+        await self._remove(entry)
+
+    async def _remove(self, entry: dict):
+        await asyncio.to_thread(_unlink, self._sidecar(entry["name"]), os.path.join(self.directory, entry["name"]))
+        self.bytes -= entry["size"]
+
+    def _adopt_orphans(self):
+        for directory in dead_worker_directories(self.root, self.directory):
+            for name in os.listdir(directory):
+                if name != LOCK_FILE:
+                    os.replace(os.path.join(directory, name), os.path.join(self.directory, name))
+
+    def _resume(self):
+        names = set(os.listdir(self.directory)) - {LOCK_FILE}
+        for name in names:
+            if name.endswith(".json"):
+                continue
+            if name + ".json" not in names:
+                _unlink(os.path.join(self.directory, name))
+                continue
+            with open(self._sidecar(name)) as file:
+                entry = json.load(file)
+            self.bytes += entry["size"]
+            self._start(entry, resumed=True)
+        for name in names:
+            if name.endswith(".json") and name.removesuffix(".json") not in names:
+                _unlink(os.path.join(self.directory, name))
+        if self._uploads:
+            logger.info(f"Resuming {len(self._uploads)} spooled uploads")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.directory is not None,
+            "directory": self.directory,
+            "bytes": self.bytes,
+            "reserved": self.reserved,
+            "max_bytes": self.max_bytes,
+            "pending": len(self._uploads),
+            "spooled": self.spooled,
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def _unlink(*paths: str):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+async def get_progress(blob_id: str) -> int | None:
+    """
+    Bytes of a spooled blob sent to S3 so far, as last published by its uploader.
+    """
+    try:
+        sent = await get_async_redis().get(PROGRESS_PREFIX + blob_id)
+    except RedisError:
+        return None
+    return int(sent) if sent is not None else None
+
+
+upload_spool = UploadSpool(
+    UPLOAD_SPOOL_DIR, UPLOAD_SPOOL_MAX_BYTES, UPLOAD_SPOOL_CONCURRENCY, UPLOAD_SPOOL_MAX_ATTEMPTS,
+    UPLOAD_SPOOL_RETRY_DELAY,
+)
+
+
+@register_collector
+def _collect(writer: PrometheusWriter):
+    writer.gauge("upload_spool_bytes", upload_spool.bytes, "Bytes of received uploads waiting in the local spool")
+    writer.gauge("upload_spool_pending", len(upload_spool._uploads), "Spooled uploads not yet stored in S3")
+    for key in ("spooled", "uploaded", "failed", "retries", "fallbacks"):
+        writer.counter(f"upload_spool_{key}_total", getattr(upload_spool, key), f"Upload spool {key}")
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List
+
+from fastapi import HTTPException, Request, status
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import ClientDisconnect
+
+from src.schemas.basic import UploadedFile
+from src.utils.s3 import S3MultipartWriter, public_url, run_s3, upload_part
+from src.utils.utils import wrap_logger
+
+logger = logging.getLogger(__name__)
+wrap_logger(logger)
+
+# Largest accepted file, matches client_max_body_size in NGINX.md
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(500 * 1024 * 1024)))
+# files per multi-file request
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "10"))
+# received files that may still be finishing their S3 upload while the next one is read
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+
+def upload_request_body(field: str = "file", multiple: bool = False) -> dict:
+    """
+    openapi_extra for routes that stream multipart files with stream_files_to_s3,
+    since the file is not a declared parameter.
+    """
+    file_schema = {"type": "string", "format": "binary"}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": [field],
+                        "properties": {field: {"type": "array", "items": file_schema} if multiple else file_schema},
+                    }
+                }
+            },
+        }
+    }
+
+
+class _Part:
+    def __init__(self):
+        self.headers: dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.writer: S3MultipartWriter | None = None
+        self.file: UploadedFile | None = None
+
+
+async def stream_files_to_s3(
+        request: Request,
+        s3_path_for: Callable[[str], str],
+        field: str = "file",
+        max_files: int = 1,
+        concurrency: int = UPLOAD_CONCURRENCY,
+        fail_fast: bool = True,
+        find_stored: Callable[[str, int], Awaitable[str | None]] | None = None,
+        writer_for: Callable[[str, str], S3MultipartWriter] = S3MultipartWriter,
+) -> List[UploadedFile]:
+    """
+    Parse a multipart/form-data body as it arrives and stream every `field` file part
+    straight to S3 (see S3MultipartWriter). Nothing is buffered whole or written to disk.
+
+    Files arrive one after another, but a received file completes its upload in the
+    background while the next one is read, up to `concurrency` files at once.
+
+    `s3_path_for` maps the file extension to the object key. Other form fields are ignored.
+    Every file is hashed while it streams. `find_stored(digest, size)` may return the key of an
+    object that already holds the same content; the file then reuses it (`deduplicated`) and
+    its own upload is dropped. Files smaller than one multipart part never reach S3 in that case.
+    With `fail_fast`, any S3 failure fails the request and objects already stored for it are
+    deleted again; otherwise the file is returned with `error` set and the others carry on.
+    Invalid or oversized bodies always fail the whole request.
+
+    `writer_for(s3_path, content_type)` creates the writer each file is streamed to; anything
+    with the S3MultipartWriter interface works, e.g. a SpoolWriter to receive into the local
+    upload spool instead (see src.utils.spool).
+    """
+    content_type, params = parse_options_header(request.headers.get("Content-Type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Expected multipart/form-data")
+
+    # the parser calls back synchronously; events are queued and written to S3 after each chunk
+    events: list[tuple] = []
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": lambda: events.append(("begin",)),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end",)),
+        "on_headers_finished": lambda: events.append(("headers_finished",)),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end",)),
+    })
+
+    files: List[UploadedFile] = []
+    uploads = _Uploads(concurrency, find_stored)
+    part = _Part()
+
+    async def failed(error: Exception):
+        # a part of the current file could not be stored
+        if fail_fast:
+            raise error
+        logger.error(f"Streaming {part.file.key} to S3 failed: {error}")
+        part.file.error = "Upload to storage failed"
+        await _abort(part.writer)
+        part.writer = None
+
+    async def handle(event: tuple):
+        nonlocal part
+        kind = event[0]
+        if kind == "begin":
+            part = _Part()
+        elif kind == "header_field":
+            part.header_field += event[1]
+        elif kind == "header_value":
+            part.header_value += event[1]
+        elif kind == "header_end":
+            part.headers[part.header_field.lower()] = part.header_value
+            part.header_field, part.header_value = b"", b""
+        elif kind == "headers_finished":
+            _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+            if options.get(b"name", b"").decode() != field or b"filename" not in options:
+                return
+            if len(files) >= max_files:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Too many files, at most {max_files} allowed")
+            filename = options[b"filename"].decode(errors="replace")
+            extension = filename.split(".")[-1]
+            file_content_type = part.headers.get(b"content-type", b"application/octet-stream").decode()
+            s3_path = s3_path_for(extension)
+            part.writer = writer_for(s3_path, file_content_type)
+            part.file = UploadedFile(
+                original_file_name=filename,
+                extension=extension,
+                content_type=file_content_type,
+                key=s3_path,
+                url=public_url(s3_path),
+                size=0,
+            )
+            files.append(part.file)
+        elif kind == "data" and part.file is not None:
+            part.file.size += len(event[1])
+            if part.file.size > UPLOAD_MAX_SIZE:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="File too large")
+            if part.writer is not None:
+                try:
+                    await part.writer.write(event[1])
+                except Exception as e:
+                    await failed(e)
+        elif kind == "end" and part.writer is not None:
+            await uploads.finish(part.writer, part.file, fail_fast)
+            part.writer = None
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event in events:
+                await handle(event)
+            events.clear()
+            uploads.raise_failed()
+        parser.finalize()
+        if part.writer is not None:
+            # the body ended in the middle of a file
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incomplete multipart body")
+        await uploads.wait()
+    except MultipartParseError:
+        await _discard(part, uploads)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid multipart body")
+    except BaseException:
+        await _discard(part, uploads)
+        raise
+
+    if not files:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=f"No '{field}' file uploaded")
+    return files
+
+
+async def append_parts_to_s3(
+        request: Request,
+        session: dict,
+        commit: Callable[[dict, int], Awaitable[None]],
+):
+    """
+    Append the body of a resumable upload chunk (PATCH) to its S3 multipart upload,
+    starting at session["offset"].
+
+    The body is cut into session["part_size"] parts, one uploading while the next is read.
+    Each stored part is passed to `commit(part, length)` in order, so a dropped connection
+    only loses the part in transit. A trailing incomplete part is not kept unless it ends
+    the file; the client resends those bytes from the committed offset.
+    """
+    part_size = session["part_size"]
+    remaining = session["size"] - session["offset"]
+    next_number = len(session["parts"]) + 1
+    buffer = bytearray()
+    in_flight: tuple[asyncio.Task, int] | None = None
+
+    async def drain():
+        nonlocal in_flight
+        if in_flight is not None:
+            task, length = in_flight
+            in_flight = None
+            await commit(await task, length)
+
+    async def submit(body: bytes):
+        nonlocal in_flight, next_number
+        await drain()
+        task = asyncio.create_task(run_s3(upload_part, session["key"], session["s3_upload_id"], next_number, body))
+        in_flight = (task, len(body))
+        next_number += 1
+
+    try:
+        async for chunk in request.stream():
+            if len(chunk) > remaining:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                                    detail="Chunk goes past the declared upload size")
+            remaining -= len(chunk)
+            buffer += chunk
+            while len(buffer) >= part_size:
+                with memoryview(buffer) as view:
+                    part = bytes(view[:part_size])
+                del buffer[:part_size]
+                await submit(part)
+        if buffer and remaining == 0:
+            await submit(bytes(buffer))
+    except ClientDisconnect:
+        pass  # keep what was stored, the client resumes from the committed offset
+    finally:
+        try:
+            await drain()
+        except Exception as e:
+            logger.error(f"Storing part of resumable upload {session['key']} failed: {e}")
+            raise
+
+
+class _Uploads:
+    """
+    Received files completing their S3 upload in the background.
+    """
+
+    def __init__(self, concurrency: int, find_stored: Callable[[str, int], Awaitable[str | None]] | None):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.find_stored = find_stored
+        self.tasks: list[asyncio.Task] = []
+        # writers of the objects this request created, deleted again if it fails
+        self.stored: List[S3MultipartWriter] = []
+
+    async def finish(self, writer: S3MultipartWriter, file: UploadedFile, fail_fast: bool):
+        # waiting for a slot stops reading the body until an earlier file is done
+        await self.slots.acquire()
+        self.tasks.append(asyncio.create_task(self._close(writer, file, fail_fast)))
+
+    async def _close(self, writer: S3MultipartWriter, file: UploadedFile, fail_fast: bool):
+        try:
+            file.digest = writer.digest
+            existing_key = await self.find_stored(file.digest, file.size) if self.find_stored else None
+            if existing_key is not None:
+                await _abort(writer)
+                file.key, file.url, file.deduplicated = existing_key, public_url(existing_key), True
+                return
+            await writer.close()
+            self.stored.append(writer)
+        except Exception as e:
+            await _abort(writer)
+            if fail_fast:
+                raise
+            logger.error(f"Completing {file.key} on S3 failed: {e}")
+            file.error = "Upload to storage failed"
+        finally:
+            self.slots.release()
+
+    def raise_failed(self):
+        for task in self.tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    async def wait(self):
+        await asyncio.gather(*self.tasks)
+
+
+async def _abort(writer: S3MultipartWriter):
+    try:
+        await writer.abort()
+    except Exception as e:
+        logger.error(f"Failed to abort multipart upload of {writer.key}: {e}")
+
+
+async def _discard(part: _Part, uploads: _Uploads):
+    if part.writer is not None:
+        await _abort(part.writer)
+    # let background uploads settle, then remove whatever they stored
+    await asyncio.gather(*uploads.tasks, return_exceptions=True)
+    try:
+        for writer in uploads.stored:
+            await writer.delete()
+    except Exception as e:
+        # the original error matters more; leftovers are reported for cleanup
+        logger.error(f"Failed to clean up streamed upload {[writer.key for writer in uploads.stored]}: {e}")
@@ -0,0 +1,47 @@
+"""
+Per-process scratch directories under a shared root, each flock'ed by its owner while it lives.
+A directory whose lock is free belongs to a worker that died or restarted.
+"""
+import fcntl
+import os
+import shutil
+from typing import IO, Iterator
+from uuid import uuid4
+
+LOCK_FILE = ".lock"
+
+
+def create_worker_directory(root: str) -> tuple[str, IO]:
+    """
+    Create and lock a directory for this process. Keep the returned lock file open for as long
+    as the directory is in use; closing it hands the directory over to dead_worker_directories.
+    """
+    # locked before it becomes visible under its final name, so it is never taken for a dead one
+    token = uuid4().hex
+    staging = os.path.join(root, f".new-{token}")
+    os.makedirs(staging)
+    lock_file = open(os.path.join(staging, LOCK_FILE), "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    directory = os.path.join(root, f"worker-{os.getpid()}-{token}")
+    os.rename(staging, directory)
+    return directory, lock_file
+
+
+def dead_worker_directories(root: str, own: str) -> Iterator[str]:
+    """
+    Yield the directories of dead workers, locked; each is removed once the caller moves on.
+    """
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        if directory == own or not name.startswith("worker-"):
+            continue
+        try:
+            with open(os.path.join(directory, LOCK_FILE), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # its worker is alive, or another one is cleaning it up
+                yield directory
+                shutil.rmtree(directory)
+        except FileNotFoundError:
+            continue  # removed by another worker meanwhile
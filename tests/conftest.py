@@ -0,0 +1,38 @@
+import os
+
+# no Redis in tests: point the clients at a closed local port so cache calls fail fast and are only logged
+os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+os.environ.setdefault("REDIS_PORT", "1")
+os.environ.setdefault("PRINCIPAL_CACHE_REDIS", "false")
+# relationships a load profile doesn't cover raise instead of lazy loading
+os.environ.setdefault("DB_STRICT_LOADING", "true")
+
+import pytest
+from sqlalchemy import String, create_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database import models
+from src.database.routing import RoutingSession
+
+
+@compiles(String, "sqlite")
+def _string_without_collation(type_, compiler, **kw):
+    # MySQL collations are not known to SQLite
+    return compiler.visit_string(String(type_.length), **kw)
+
+
+@pytest.fixture
+def db():
+    """
+    Session on a fresh in-memory SQLite database, configured like SessionLocal.
+    """
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(class_=RoutingSession, autoflush=False, expire_on_commit=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,34 @@
+from src.crud import blob as blob_crud, user as user_crud
+from src.database import models
+from src.database.profiling import count_queries
+
+
+def attach_blob(db, user_id: str, index: int) -> int:
+    with count_queries() as profile:
+        blob_crud.create_user_blob(db, user_id, f"file-{index}.png", "image/png", f"http://bucket/{index}.png")
+    return profile.statements
+
+
+def test_attaching_a_blob_does_not_load_the_collection(db):
+    user = user_crud.create_user(db, "name", "owner", "password")
+
+    first = attach_blob(db, user.id, 0)
+    for index in range(1, 50):
+        attach_blob(db, user.id, index)
+
+    assert attach_blob(db, user.id, 50) == first
+
+
+def test_appending_through_the_relationship_does_not_select_it(db):
+    user = user_crud.create_user(db, "name", "appender", "password")
+    for index in range(10):
+        attach_blob(db, user.id, index)
+    db.expunge_all()
+    user = user_crud.get_user_by_id(db, user.id)
+
+    with count_queries() as profile:
+        user.blobs.add(models.Blob(filename="new.png", content_type="image/png", url="http://bucket/new.png"))
+        db.commit()
+
+    assert [shape for shape in profile.shapes if shape.lstrip().upper().startswith("SELECT")] == []
+    assert profile.statements == 2
@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+
+from src.crud import user as user_crud
+from src.crud.loading import UserLoad
+from src.dependencies.auth import get_user_by_username
+
+
+def test_relationships_outside_the_load_profile_raise(db):
+    user_crud.create_user(db, "name", "strict", "password")
+    db.expunge_all()
+
+    user = get_user_by_username(db, "strict", UserLoad.ACCOUNT)
+    assert user.account[0].username == "strict"
+    with pytest.raises(InvalidRequestError):
+        user.account[0].user
+
+
+def test_bare_profile_loads_no_relationship(db):
+    user_id = user_crud.create_user(db, "name", "bare", "password").id
+    db.expunge_all()
+
+    user = user_crud.get_user_by_id(db, user_id, UserLoad.BARE)
+    with pytest.raises(InvalidRequestError):
+        user.account
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from src.database.profiling import QueryBudgetExceeded, QueryBudgetMiddleware
+
+
+def budget_client(db, mode: str) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(QueryBudgetMiddleware, mode=mode, max_statements=3, max_repeats=2)
+
+    @app.get("/statements/{count}")
+    async def run_statements(count: int):
+        for index in range(count):
+            db.execute(text(f"SELECT {index}"))
+        return {}
+
+    @app.get("/repeats/{count}")
+    async def run_repeats(count: int):
+        for _ in range(count):
+            db.execute(text("SELECT 1"))
+        return {}
+
+    return TestClient(app)
+
+
+def test_within_budget_reports_statements(db):
+    response = budget_client(db, "raise").get("/statements/3")
+
+    assert response.status_code == 200
+    assert response.headers["X-DB-Statements"] == "3"
+
+
+def test_raise_mode_fails_over_budget(db):
+    with pytest.raises(QueryBudgetExceeded, match=r"4 statements \(budget 3\)"):
+        budget_client(db, "raise").get("/statements/4")
+
+
+def test_raise_mode_fails_on_n_plus_one(db):
+    with pytest.raises(QueryBudgetExceeded, match="N\\+1 suspect, 3x"):
+        budget_client(db, "raise").get("/repeats/3")
+
+
+def test_log_mode_only_warns(db):
+    response = budget_client(db, "log").get("/statements/4")
+
+    assert response.status_code == 200
+    assert response.headers["X-DB-Statements"] == "4"
@@ -0,0 +1,45 @@
+import asyncio
+
+from src.crud import blob as blob_crud, principal_cache, user as user_crud
+from src.database.profiling import count_queries
+from src.dependencies.auth import load_user
+
+
+def inserts(profile) -> list[str]:
+    return [shape for shape in profile.shapes.elements() if shape.lstrip().upper().startswith("INSERT")]
+
+
+def test_signup_is_two_inserts(db):
+    with count_queries() as profile:
+        user = user_crud.create_user(db, "name", "signup", "password")
+
+    assert profile.statements == 2
+    assert len(inserts(profile)) == 2
+    # ids and timestamps are generated client-side, nothing is read back
+    with count_queries() as profile:
+        assert user.id and user.created_at and user.account[0].username == "signup"
+    assert profile.statements == 0
+
+
+def test_upload_is_two_inserts(db):
+    user = user_crud.create_user(db, "name", "uploader", "password")
+
+    with count_queries() as profile:
+        blob_crud.create_user_blob(db, user.id, "file.png", "image/png", "http://bucket/file.png")
+
+    assert profile.statements == 2
+    assert len(inserts(profile)) == 2
+
+
+def test_principal_lookup_on_a_cold_cache(db):
+    user_crud.create_user(db, "name", "principal", "password")
+    principal_cache.local_cache.pop("principal")
+
+    with count_queries() as cold:
+        asyncio.run(load_user(db, {"sub": "principal"}))
+    db.expunge_all()
+    with count_queries() as warm:
+        asyncio.run(load_user(db, {"sub": "principal"}))
+
+    assert cold.statements == 1
+    assert warm.statements == 0